@@ -0,0 +1,283 @@
+"""
+Banc de performance du bot, sans réseau : un faux mangamoins en local (HTTP) et un faux bucket B2.
+
+    python bench.py                       # 1, 10 et 100 mangas
+    python bench.py --mangas 10 --latency 0.05 --json bench.json
+
+Pour chaque taille, deux runs de bot.main : "fresh" (des chapitres à télécharger) puis
+"steady" (rien de nouveau). On mesure la durée, les requêtes par endpoint,
+les transactions B2 par classe et le pic mémoire (tracemalloc).
+"""
+import argparse
+import hashlib
+import http.server
+import itertools
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import b2sdk.v2 as b2
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# --- FAUX SITE SOURCE ---
+
+class FakeSource(http.server.ThreadingHTTPServer):
+    """ Imite /files/scans/<id>/NN.png : latence, nombre de pages et 404 configurables """
+    daemon_threads = True
+
+    def __init__(self, latency, page_size):
+        super().__init__(('127.0.0.1', 0), SourceHandler)
+        self.latency = latency
+        self.page = os.urandom(page_size)
+        self.scans = {} # scan_id => nombre de pages (absent = 404)
+        self.requests = Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, endpoint):
+        with self.lock: self.requests[endpoint] += 1
+
+class SourceHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, with_body):
+        source = self.server
+        time.sleep(source.latency)
+        m = re.match(r'^/files/scans/([^/]+)/(\d+)\.png$', self.path)
+        if m:
+            pages = source.scans.get(m.group(1), 0)
+            name = m.group(2)
+            found = 1 <= int(name) <= pages and (len(name) == 2 or name == "1")
+            endpoint = "page" if with_body and 'Range' not in self.headers else "probe"
+        else:
+            found = self.path == '/' or self.path.startswith('/?p=')
+            endpoint = "feed" if found else "other"
+        source.count(f"{self.command} {endpoint}" + ("" if found else " (404)"))
+
+        body = source.page if found and m else (b"<html></html>" if found else b"")
+        status = 200 if found else 404
+        if found and m and 'Range' in self.headers:
+            body, status = body[:1], 206
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if with_body: self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(True)
+
+    def do_HEAD(self):
+        self._reply(False)
+
+# --- FAUX BUCKET B2 ---
+# Classes de transactions B2 : A = uploads/suppressions (gratuites), B = lectures de fichiers,
+# C = listings / infos bucket. Un ls compte une transaction C par tranche de 1000 fichiers.
+
+class FakeFileVersion:
+    _ids = itertools.count(1)
+
+    def __init__(self, file_name, data, file_info=None):
+        self.id_ = f"4_fake_{next(self._ids)}"
+        self.file_name = file_name
+        self.size = len(data)
+        self.content_sha1 = hashlib.sha1(data).hexdigest()
+        self.upload_timestamp = int(time.time() * 1000)
+        self.file_info = file_info or {}
+
+    def delete(self):
+        pass
+
+class FakeBucket:
+    """ Implémente la surface de b2sdk.Bucket utilisée par storage.py """
+    name = "bench-bucket"
+    id_ = "bench"
+
+    def __init__(self):
+        self.files = {}
+        self.versions = {} # file_name => [versions] (les anciennes aussi)
+        self.transactions = Counter()
+        self.bytes_uploaded = 0
+        self.lock = threading.Lock()
+
+    def _tx(self, klass, n=1):
+        with self.lock: self.transactions[klass] += n
+
+    def put(self, file_name, data, file_info=None):
+        version = FakeFileVersion(file_name, data, file_info)
+        with self.lock:
+            self.files[file_name] = version
+            self.versions.setdefault(file_name, []).append(version)
+        return version
+
+    def ls(self, folder_to_list='', latest_only=True, recursive=False, **kwargs):
+        with self.lock:
+            if latest_only:
+                found = [v for name, v in sorted(self.files.items()) if name.startswith(folder_to_list)]
+            else:
+                found = [v for name, vs in sorted(self.versions.items()) if name.startswith(folder_to_list) for v in vs]
+        self._tx("C", max(1, -(-len(found) // 1000)))
+        for version in found:
+            yield version, None
+
+    def upload_bytes(self, data_bytes, file_name, content_type=None, file_info=None, **kwargs):
+        self._tx("A")
+        with self.lock: self.bytes_uploaded += len(data_bytes)
+        return self.put(file_name, data_bytes, file_info)
+
+    def upload(self, upload_source, file_name, **kwargs):
+        with upload_source.open() as f:
+            return self.upload_bytes(f.read(), file_name, **kwargs)
+
+    def upload_local_file(self, local_file, file_name, **kwargs):
+        with open(local_file, 'rb') as f:
+            return self.upload_bytes(f.read(), file_name, **kwargs)
+
+    def upload_unbound_stream(self, read_only_object, file_name, **kwargs):
+        return self.upload_bytes(read_only_object.read(), file_name, **kwargs)
+
+    def delete_file_version(self, file_id, file_name):
+        self._tx("A")
+        with self.lock:
+            versions = [v for v in self.versions.get(file_name, []) if v.id_ != file_id]
+            if versions: self.versions[file_name] = versions
+            else: self.versions.pop(file_name, None)
+            if file_name in self.files and self.files[file_name].id_ == file_id:
+                if versions: self.files[file_name] = versions[-1]
+                else: del self.files[file_name]
+
+    def get_file_info_by_name(self, file_name):
+        self._tx("B")
+        with self.lock:
+            if file_name not in self.files:
+                raise b2.exception.FileNotPresent(file_name)
+            return self.files[file_name]
+
+    def update(self, **kwargs):
+        self._tx("C")
+        return self
+
+# --- SCÉNARIOS ---
+
+def build_catalog(source, bucket, n_mangas, existing, new, pages):
+    """ n mangas : `existing` chapitres déjà sur B2, `new` chapitres de plus sur le site """
+    names = {}
+    for i in range(n_mangas):
+        # Préfixe sans chiffres (comme OP / LDS) : BMAAA, BMAAB...
+        name, prefix = f"Bench Manga {i:03d}", "BM" + "".join(chr(65 + int(d)) for d in f"{i:03d}")
+        names[name] = prefix
+        for c in range(1, existing + new + 1):
+            source.scans[f"{prefix}{c}"] = pages
+        for c in range(1, existing + 1):
+            for p in range(1, pages + 1):
+                bucket.put(f"mangas/{name}/{c}/{p:02d}.png", source.page)
+    return names
+
+def run_once(bot, storage, source, bucket):
+    """ Un run complet de bot.main. Retourne les mesures """
+    storage._inventory = None
+    storage.client = storage.Storage(BENCH_CREDS, backend=bucket)
+    source.requests.clear()
+    bucket.transactions.clear()
+    bucket.bytes_uploaded = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    bot.main()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": round(elapsed, 3),
+        "requests": dict(sorted(source.requests.items())),
+        "b2_transactions": dict(sorted(bucket.transactions.items())),
+        "bytes_uploaded": bucket.bytes_uploaded,
+        "peak_memory_mb": round(peak / 2**20, 1)
+    }
+
+BENCH_CREDS = {"application_key_id": "bench", "application_key": "bench", "bucket_name": FakeBucket.name}
+
+def bench(sizes, args):
+    work = tempfile.mkdtemp(prefix="mangariss-bench-")
+    os.chdir(work)
+    sys.path.insert(0, REPO_DIR)
+    with open(os.path.join(REPO_DIR, 'config.json')) as f: base_config = json.load(f)
+    import bot, storage # Importés après le chdir
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    results = {}
+    try:
+        for n in sizes:
+            source = FakeSource(args.latency, args.page_kb * 1024)
+            threading.Thread(target=source.serve_forever, daemon=True).start()
+            bucket = FakeBucket()
+            names = build_catalog(source, bucket, n, args.existing, args.new, args.pages)
+
+            shutil.rmtree('api', ignore_errors=True)
+            # request_delay = 0 : on mesure le moteur, pas la pause de politesse entre pages du flux
+            config = dict(base_config, source_url=source.url, http_engine=args.engine, request_delay=0)
+            with open('config.json', 'w') as f: json.dump(config, f)
+            with open('mangas.txt', 'w') as f: f.write("\n".join(names))
+            bot.SCAN_PREFIX.clear()
+            bot.SCAN_PREFIX.update(names)
+
+            results[n] = {
+                "fresh": run_once(bot, storage, source, bucket),
+                "steady": run_once(bot, storage, source, bucket)
+            }
+            source.shutdown()
+            source.server_close()
+    finally:
+        os.chdir(REPO_DIR)
+        shutil.rmtree(work, ignore_errors=True)
+    return results
+
+def print_report(results):
+    print()
+    print(f"{'mangas':>6} {'run':<7} {'durée (s)':>10} {'req. source':>12} {'B2 A/B/C':>12} {'pic (Mo)':>9}")
+    for n, runs in results.items():
+        for label, r in runs.items():
+            tx = r["b2_transactions"]
+            abc = f"{tx.get('A', 0)}/{tx.get('B', 0)}/{tx.get('C', 0)}"
+            print(f"{n:>6} {label:<7} {r['seconds']:>10.2f} {sum(r['requests'].values()):>12} {abc:>12} {r['peak_memory_mb']:>9}")
+    print()
+    for n, runs in results.items():
+        for label, r in runs.items():
+            print(f"[{n} mangas / {label}] " + ", ".join(f"{k}: {v}" for k, v in r["requests"].items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc de performance du bot (site source et B2 simulés)")
+    parser.add_argument("--mangas", default="1,10,100", help="tailles testées (ex: 1,10,100)")
+    parser.add_argument("--latency", type=float, default=0.02, help="latence du faux site, en secondes")
+    parser.add_argument("--pages", type=int, default=20, help="pages par chapitre")
+    parser.add_argument("--page-kb", type=int, default=200, help="taille d'une page en Ko")
+    parser.add_argument("--existing", type=int, default=3, help="chapitres déjà sur B2 par manga")
+    parser.add_argument("--new", type=int, default=1, help="nouveaux chapitres par manga")
+    parser.add_argument("--engine", default="sync", choices=["sync", "async"], help="moteur HTTP du scraper")
+    parser.add_argument("--json", help="écrit les résultats dans ce fichier")
+    parser.add_argument("--verbose", action="store_true", help="garde les logs du bot")
+    args = parser.parse_args()
+
+    sizes = [int(x) for x in args.mangas.split(",") if x.strip()]
+    output = os.path.abspath(args.json) if args.json else None
+    results = bench(sizes, args)
+    print_report(results)
+    if output:
+        with open(output, 'w', encoding='utf-8') as f: json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
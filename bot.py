@@ -1,9 +1,22 @@
+import http.server
 import logging
 import json
 import os
+import queue
+import signal
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+import bundle
+import metrics
+import publisher
+import resilience
+import schedule
 import scraper
 import storage
+import transcode
 
 # --- CONFIG LOGS ---
 if not os.path.exists('logs'): os.makedirs('logs')
@@ -24,6 +37,28 @@ B2_CLUSTER = "f003"
 
 def load_config():
     with open('config.json', 'r') as f: return json.load(f)
+# État persistant du bot entre deux runs (commité avec api/, comme le manifest)
+STATE_PATH = 'api/state.json'
+
+# Champs du calendrier qui bougent à chaque ping : gardés hors de api/ (cache Actions) pour qu'un run
+# sans nouveauté ne produise pas de commit. L'historique des sorties reste dans state.json.
+SCHEDULE_PATH = 'logs/schedule.json'
+VOLATILE_SCHEDULE = ("last_probe", "misses", "next_probe", "expected")
+
+def load_state():
+    state = publisher.read_json(STATE_PATH, {})
+    if not isinstance(state, dict): return {}
+    for m_name, fields in publisher.read_json(SCHEDULE_PATH, {}).items():
+        state.setdefault("schedule", {}).setdefault(m_name, {}).update(fields)
+    return state
+def save_state(state):
+    plan = state.get("schedule", {})
+    persisted = dict(state)
+    if plan:
+        persisted["schedule"] = {m: {k: v for k, v in e.items() if k not in VOLATILE_SCHEDULE} for m, e in plan.items()}
+        volatile = {m: {k: e[k] for k in VOLATILE_SCHEDULE if k in e} for m, e in plan.items()}
+        publisher.write_json(SCHEDULE_PATH, volatile)
+    publisher.write_if_changed(STATE_PATH, json.dumps(persisted, indent=2, ensure_ascii=False, sort_keys=True).encode('utf-8'))
 def load_mangas():
     if not os.path.exists('mangas.txt'): return []
     with open('mangas.txt', 'r') as f: return [line.strip() for line in f if line.strip()]
@@ -38,8 +73,9 @@ def normalize_name(name):
     n = " ".join(n.split())
     return n.lower()
 
-def parse_trigger_mangas():
-    raw = os.getenv("TRIGGER_MANGA", "").strip()
+def parse_trigger_mangas(raw=None):
+    if raw is None: raw = os.getenv("TRIGGER_MANGA", "")
+    raw = raw.strip()
     if not raw: return []
     if raw[0] in "[{":
         try:
@@ -53,8 +89,9 @@ def parse_trigger_mangas():
     return [normalize_name(p) for p in parts]
 
 # Scan IDs envoyés par le webhook (ex: OP1164, LDS91, ou URL ?scan=OP1164)
-def parse_trigger_scans():
-    raw = os.getenv("TRIGGER_SCAN", "").strip()
+def parse_trigger_scans(raw=None):
+    if raw is None: raw = os.getenv("TRIGGER_SCAN", "")
+    raw = raw.strip()
     if not raw: return []
     # Si on reçoit une URL complète
     if "?scan=" in raw:
@@ -95,201 +132,709 @@ def sort_key(chap_str):
     try: return float(chap_str)
     except: return 0.0
 
-def main():
-    logger.info("🤖 --- DÉMARRAGE BOT (Smart Filter) ---")
-    config = load_config()
-    tracked_names = load_mangas()
-    trigger = parse_trigger_mangas()
-    trigger_scans = parse_trigger_scans()
+def first_missing_page(existing_files):
+    """ Première page absente d'un chapitre interrompu (ex: {01, 02, 04} => 3) """
+    nums = set()
+    for f in existing_files:
+        try: nums.add(int(f.split('.')[0]))
+        except ValueError: continue
+    page = 1
+    while page in nums: page += 1
+    return page
+
+def store_preview(m_name, c_num, data):
+    """ Miniature + placeholder de la première page du chapitre (un échec n'empêche pas la lecture) """
+    try:
+        thumb, meta = transcode.preview(data)
+        storage.upload_image(m_name, c_num, storage.CHAPTER_THUMB, thumb, meta)
+        metrics.count("previews_stored")
+    except Exception as e:
+        logger.warning(f"      ⚠️ Aperçu non généré ({m_name} {c_num}) : {e}")
+
+def store_cover_preview(m_name):
+    """ Miniature + placeholder de la cover, refaits seulement quand la cover change """
+    local_path = storage.local_cover(m_name)
+    if not local_path or not storage.cover_thumb_stale(m_name): return
+    try:
+        with open(local_path, 'rb') as f:
+            thumb, meta = transcode.preview(f.read())
+        storage.upload_cover_thumb(m_name, thumb, meta)
+        metrics.count("previews_stored")
+    except Exception as e:
+        logger.warning(f"⚠️ Aperçu de cover non généré ({m_name}) : {e}")
+
+def store_page(m_name, c_num, filename, content, chapter_bundle=None):
+    """
+    Transcode (si activé) puis upload une page. Retourne True si tout est sur B2.
+    La version servie au lecteur (la première) est aussi ajoutée à l'archive du chapitre, si elle est construite,
+    et sert d'aperçu du chapitre si c'est la première page.
+    """
+    try:
+        try:
+            files = transcode.convert(filename, content)
+        except Exception as e:
+            logger.warning(f"      ⚠️ Échec transcodage {filename} : {e}")
+            return False
+        for name, data in files:
+            storage.upload_image(m_name, c_num, name, data, transcode.image_meta(data))
+        if chapter_bundle is not None:
+            chapter_bundle.add(*files[0])
+        if transcode.previews_enabled() and filename.startswith("01."):
+            store_preview(m_name, c_num, files[0][1])
+        return True
+    except Exception as e:
+        logger.warning(f"      ⚠️ Erreur B2 {filename} : {e}")
+        return False
+    finally:
+        content.close() # Fichier temporaire de la page (si elle dépassait spool_kb)
+
+def upload_pages(m_name, c_num, pages, workers, chapter_bundle=None):
+    """
+    Upload les pages au fil de l'eau sur un pool de workers, pendant que le
+    générateur continue de télécharger les suivantes (et les ajoute à `chapter_bundle` s'il est fourni).
+    Le nombre de pages en attente d'upload est borné (mémoire maîtrisée).
+    Retourne (nombre de pages du chapitre si tout s'est bien passé sinon None, pages en échec).
+    """
+    workers = max(1, workers)
+    slots = threading.BoundedSemaphore(workers * 2)
+    uploads = []
+    last_page = None
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            try:
+                filename, content = next(pages)
+            except StopIteration as end:
+                last_page = end.value # None si le téléchargement s'est arrêté sur une erreur
+                break
+            slots.acquire()
+            future = pool.submit(store_page, m_name, c_num, filename, content, chapter_bundle)
+            future.add_done_callback(lambda _: slots.release())
+            uploads.append((filename, future))
+    failed = []
+    for filename, future in uploads:
+        if future.result():
+            metrics.count("pages_stored")
+            logger.info(f"      ☁️ UP : {filename}")
+        else:
+            logger.warning(f"      ⚠️ Échec upload : {filename}")
+            failed.append(filename)
+    return (None if failed else last_page), failed
+
+def analyse_state(m_name, max_chaps):
+    """ Regarde ce qu'on a DÉJÀ sur B2 pour définir ce qu'on refuse de télécharger """
+    existing = storage.list_chapters_on_b2(m_name)
+    existing.sort(key=sort_key) # Tri du plus vieux au plus récent (ex: 10, 11, 12)
+    
+    cutoff_value = -1.0
+    
+    # Si on a déjà atteint ou dépassé la limite (ex: 10 chapitres)
+    if max_chaps > 0 and len(existing) >= max_chaps:
+        # On définit la limite : tout ce qui est plus vieux que le 10ème en partant de la fin est IGNORÉ.
+        # ex: on a [1, 2... 40, 41, ... 50]. On garde les 10 derniers (41-50).
+        # Le cutoff devient 41. Tout ce qui est < 41 sur le site sera ignoré.
+        keep_list = existing[-max_chaps:] # Les 10 derniers
+        cutoff_value = sort_key(keep_list[0]) # Le plus petit des "gardés"
+        
+    if cutoff_value > 0:
+        logger.info(f"   🛡️ {m_name} : Filtre activé. On ignore tout ce qui est < Chapitre {cutoff_value}")
+    return {
+        "existing_chapters": set(existing),
+        "cutoff": cutoff_value
+    }
+
+def chapters_from_scans(tracked_names, trigger_scans):
+    """ Associe scans ↔ mangas (si un seul manga, on lui applique tous les scans) """
+    found_chapters = []
+    for idx, scan_id in enumerate(trigger_scans):
+        manga_name = tracked_names[min(idx, len(tracked_names)-1)]
+        c_num = "".join([c for c in scan_id if c.isdigit()]) or "0"
+        found_chapters.append({
+            "manga_name": manga_name,
+            "author": "Inconnu",
+            "scan_id": scan_id,
+            "chapter_num": c_num,
+            "chapter_title": ""
+        })
+    return found_chapters
+
+def chapter_entry(m_name, prefix, num):
+    return {
+        "manga_name": m_name,
+        "author": "Inconnu",
+        "scan_id": f"{prefix}{num}",
+        "chapter_num": str(num),
+        "chapter_title": ""
+    }
+
+def ping_next_chapter(m_name, state, bot_scraper, probe_ahead=1):
+    """
+    Teste si les prochains chapitres sont dispos sur le site source
+    (N+1 ... N+probe_ahead en parallèle, pour rattraper plusieurs sorties d'un coup)
+    """
+    prefix = SCAN_PREFIX.get(m_name)
+    if not prefix:
+        logger.warning(f"⚠️ Prefix scan manquant pour {m_name}")
+        return []
+    next_num = next_chapter_number(state["existing_chapters"])
+    available = bot_scraper.probe_chapters(prefix, next_num, probe_ahead)
+    if not available:
+        logger.info(f"⏭️ {m_name} {next_num} pas dispo")
+    return [chapter_entry(m_name, prefix, num) for num in available]
+
+def find_latest_chapter(bot_scraper, prefix, first, limit, known=None):
+    """
+    Cherche le dernier chapitre dispo à partir de `first` (supposé dispo) :
+    recherche exponentielle (first+1, +2, +4...) puis dichotomie entre le dernier trouvé et le premier absent.
+    `limit` borne le nombre de chapitres d'avance explorés.
+    Au-delà de `first`, seul le nommage connu est testé (un chapitre absent = une requête).
+    `known` = résultats déjà obtenus ({numéro: dispo}, ex: probe_chapters), pas re-testés.
+    """
+    known = known or {}
+    def exists(num):
+        if num not in known: known[num] = bot_scraper.scan_exists(f"{prefix}{num}", fallback=False)
+        return known[num]
+    found, step = first, 1
+    missing = None
+    while step <= limit:
+        if exists(first + step):
+            found = first + step
+            step *= 2
+        else:
+            missing = first + step
+            break
+    if missing is None:
+        return found # Limite atteinte : on s'arrête au dernier trouvé
+    while missing - found > 1:
+        mid = (found + missing) // 2
+        if exists(mid): found = mid
+        else: missing = mid
+    return found
+
+def catch_up(m_name, state, bot_scraper, config):
+    """
+    Mode rattrapage : trouve le dernier chapitre dispo et retourne tous les chapitres
+    manquants, limités à la fenêtre de rétention (max_chapters).
+    """
+    prefix = SCAN_PREFIX.get(m_name)
+    if not prefix:
+        logger.warning(f"⚠️ Prefix scan manquant pour {m_name}")
+        return []
+    next_num = next_chapter_number(state["existing_chapters"])
+    probe_ahead = max(1, config.get('probe_ahead', 1))
+    available = bot_scraper.probe_chapters(prefix, next_num, probe_ahead)
+    if not available:
+        logger.info(f"⏭️ {m_name} {next_num} pas dispo")
+        return []
+    probed = {num: num in available for num in range(next_num, next_num + probe_ahead)}
+    latest = find_latest_chapter(bot_scraper, prefix, available[-1], config.get('catch_up_limit', 4096), probed)
+
+    first = next_num
+    max_chaps = config.get('max_chapters', 0)
+    if max_chaps > 0:
+        first = max(first, latest - max_chaps + 1)
+    if latest > next_num:
+        logger.info(f"⏩ {m_name} : rattrapage {first} → {latest}")
+    return [chapter_entry(m_name, prefix, num) for num in range(first, latest + 1)]
+
+# Chapitres restés incomplets (pages en échec, téléchargement interrompu), retentés aux runs suivants :
+# state["retry"][manga][chapitre] = {"scan_id": "OP1164", "failed": ["05.png"], "runs": 1}
+MAX_RETRY_RUNS = 5
+
+def process_chapter(m_name, chap, bot_scraper, upload_workers, retries=None, bundles=False):
+    """
+    Télécharge/upload un chapitre s'il n'est pas complet. Retourne True si le chapitre a des pages sur B2.
+    Un chapitre qui reste incomplet est noté dans `retries` pour le prochain run.
+    `bundles` : construit aussi l'archive CBZ du chapitre (seulement s'il est téléchargé en entier ce run).
+    """
+    retries = {} if retries is None else retries
+    c_num = chap['chapter_num']
+    # Si le chapitre est valide, on vérifie s'il faut le télécharger
+    # (un chapitre interrompu reprend à sa première page manquante)
+    if not storage.is_chapter_complete(m_name, c_num):
+        existing_files = storage.list_files_in_chapter(m_name, c_num)
+        start_page = first_missing_page(existing_files)
+        if existing_files:
+            logger.info(f"🔁 Reprise : {m_name} {c_num} à partir de la page {start_page}")
+        else:
+            logger.info(f"🔎 Traitement : {m_name} {c_num}")
+        pages = bot_scraper.download_images_generator(chap['scan_id'], start_page=start_page)
+        # Une reprise n'a pas les premières pages sous la main : pas d'archive (elle serait incomplète)
+        chapter_bundle = bundle.ChapterBundle() if bundles and start_page == 1 else None
+        try:
+            pages_count, failed = upload_pages(m_name, c_num, pages, upload_workers, chapter_bundle)
+            complete = pages_count is not None and storage.mark_chapter_complete(m_name, c_num, pages_count, transcode.page_ext())
+            if complete and chapter_bundle is not None:
+                try:
+                    storage.upload_chapter_bundle(m_name, c_num, chapter_bundle.finish())
+                    metrics.count("bundles_stored")
+                    logger.info(f"      📦 Archive : {storage.CHAPTER_BUNDLE} ({chapter_bundle.size // 1024} Ko)")
+                except Exception as e:
+                    logger.warning(f"      ⚠️ Archive non uploadée ({m_name} {c_num}) : {e}")
+        finally:
+            if chapter_bundle is not None: chapter_bundle.close()
+        if complete:
+            metrics.count("chapters_completed")
+            retries.pop(str(c_num), None)
+            # Liste exacte des pages pour le lecteur (plus besoin de deviner les URLs)
+            try:
+                storage.upload_chapter_manifest(m_name, c_num)
+            except Exception as e:
+                logger.warning(f"      ⚠️ Manifest de pages non uploadé ({m_name} {c_num}) : {e}")
+        else:
+            previous = retries.get(str(c_num), {})
+            retries[str(c_num)] = {"scan_id": chap['scan_id'], "failed": failed, "runs": previous.get("runs", 0) + 1}
+            metrics.count("chapters_incomplete")
+            logger.warning(f"      🔁 {m_name} {c_num} incomplet : nouvel essai au prochain run")
+        # Pages uploadées enregistrées tout de suite : un run tué ne les retélécharge pas
+        storage.save_manifest()
+    return len(storage.list_files_in_chapter(m_name, c_num)) > 0
+
+def process_manga(m_name, bot_scraper, config, found_chapters=None, retries=None):
+    """
+    Traite un manga de bout en bout (cover, état B2, ping, téléchargement)
+    et retourne son entrée pour le JSON final + les chapitres à supprimer (rétention).
+    `found_chapters` = chapitres imposés (mode scan ID), sinon on ping le prochain.
+    `retries` = chapitres incomplets des runs précédents (state["retry"][manga]), retentés ici.
+    """
+    retries = {} if retries is None else retries
+    bucket_name = storage.client.bucket_name
+    max_chaps = config.get('max_chapters', 0)
+    upload_workers = config.get('upload_workers', 1)
+    bundles = (config.get('bundle') or {}).get('enabled', False)
+    retention_dry_run = (config.get('retention') or {}).get('dry_run', False)
+
+    # 1. Gestion de la cover
+    cover_url = storage.upload_cover(m_name)
+    if not cover_url:
+        cover_url = f"https://{B2_CLUSTER}.backblazeb2.com/file/{bucket_name}/mangas/{m_name}/cover.jpg"
+    if transcode.previews_enabled():
+        store_cover_preview(m_name)
+
+    # 2. ANALYSE DE L'ÉTAT ACTUEL (Le point crucial)
+    current_state = analyse_state(m_name, max_chaps)
+
+    # 3. Scan Site Source (ou mode direct via scan ID)
+    if found_chapters is None:
+        if config.get('catch_up', False):
+            found_chapters = catch_up(m_name, current_state, bot_scraper, config)
+        else:
+            found_chapters = ping_next_chapter(m_name, current_state, bot_scraper, config.get('probe_ahead', 1))
+
+    # Chapitres restés incomplets aux runs précédents
+    found_chapters = list(found_chapters)
+    known = {str(chap['chapter_num']) for chap in found_chapters}
+    for c_num, retry in list(retries.items()):
+        if retry["runs"] >= MAX_RETRY_RUNS:
+            logger.warning(f"⚠️ {m_name} {c_num} : abandon après {retry['runs']} runs incomplets")
+            del retries[c_num]
+        elif c_num not in known:
+            found_chapters.append({
+                "manga_name": m_name, "author": "Inconnu", "scan_id": retry["scan_id"],
+                "chapter_num": c_num, "chapter_title": ""
+            })
+
+    # 4. Entrée pour le JSON final
+    entry = { "title": m_name, "author": "Inconnu", "cover": cover_url, "chapters": [] }
+    cover_preview = storage.cover_preview(m_name)
+    if cover_preview:
+        entry["cover_thumb"], entry["cover_placeholder"] = cover_preview["thumb"], cover_preview["placeholder"]
+
+    # 5. TRAITEMENT INTELLIGENT
+    to_process = []
+    for chap in found_chapters:
+        c_val = sort_key(chap['chapter_num'])
+        
+        if chap['author'] != "Inconnu": entry['author'] = chap['author']
+
+        # --- LE FILTRE ANTI-BOUCLE EST ICI ---
+        # Si le chapitre est trop vieux (inférieur au cutoff), ON ZAPPE IMMÉDIATEMENT
+        # Cela économise les transactions "Class C" car on ne vérifie même pas les fichiers
+        if current_state['cutoff'] > 0 and c_val < current_state['cutoff']:
+            # logger.info(f"   ⛔ Trop vieux : {m_name} {c_num} (Ignoré)") # Décommenter pour debug
+            retries.pop(str(chap['chapter_num']), None)
+            continue
+        to_process.append(chap)
+
+    # Les chapitres d'un même manga sont traités en parallèle (rattrapage)
+    with ThreadPoolExecutor(max_workers=max(1, config.get('chapter_workers', 1))) as pool:
+        results = list(pool.map(lambda chap: process_chapter(m_name, chap, bot_scraper, upload_workers, retries, bundles), to_process))
+    for chap, has_pages in zip(to_process, results):
+        # On met à jour l'état local pour le nettoyage final
+        if has_pages:
+            current_state['existing_chapters'].add(str(chap['chapter_num']))
+
+    # 6. RÉTENTION : on calcule ce qu'on garde
+    # Note: On utilise notre set en mémoire pour éviter un appel API B2 coûteux
+    all_chaps = list(current_state['existing_chapters'])
+    all_chaps.sort(key=sort_key)
+
+    # Logique de suppression (exécutée en lot pour tous les mangas à la fin du run)
+    chaps_to_kill = []
+    if max_chaps > 0 and len(all_chaps) > max_chaps:
+        nb_to_delete = len(all_chaps) - max_chaps
+        # Sécurité cover
+        chaps_to_kill = [c for c in all_chaps[:nb_to_delete] if "cover" not in str(c).lower()] # Les plus vieux
+        # Les récents (dry-run : rien n'est supprimé, le JSON publié reste inchangé)
+        chaps_to_keep = all_chaps if retention_dry_run else all_chaps[nb_to_delete:]
+    else:
+        chaps_to_keep = all_chaps
+
+    # Construction JSON
+    for c_num in chaps_to_keep:
+        if "cover" in str(c_num).lower(): continue
+        
+        # Le compte de pages vient de l'inventaire en mémoire (aucun appel B2)
+        
+        folder_url = f"https://{B2_CLUSTER}.backblazeb2.com/file/{bucket_name}/mangas/{m_name}/{c_num}/"
+        chapter = {
+            "number": c_num,
+            "title": f"Chapitre {c_num}",
+            "folder_url": folder_url,
+            "pages_count": storage.chapter_pages_count(m_name, c_num),
+            "page_ext": storage.chapter_page_ext(m_name, c_num)
+        }
+        if chapter["pages_count"]:
+            chapter["manifest"] = f"details/{manga_slug(m_name)}/chapters/{c_num}.json"
+        chapter_bundle = storage.chapter_bundle(m_name, c_num, folder_url)
+        if chapter_bundle:
+            # Tout le chapitre en un seul objet (offsets des pages dans le manifest)
+            chapter["bundle"], chapter["bundle_size"] = chapter_bundle
+        preview = storage.chapter_preview(m_name, c_num, folder_url)
+        if preview:
+            chapter.update(preview) # Miniature de la première page + placeholder inline
+        entry['chapters'].append(chapter)
+
+    # Tri décroissant (récent en haut)
+    entry['chapters'].sort(key=lambda x: sort_key(x['number']), reverse=True)
+    return entry, chaps_to_kill
+
+def manga_slug(m_name):
+    return m_name.lower().replace(' ', '-')
+
+def publish_api(db_store, all_names, api_config):
+    """
+    Génère l'API (index + shards de mangas, tête + pages d'archive par manga).
+    Seuls les fichiers dont le contenu change sont réécrits (écriture atomique).
+    Les mangas non traités ce run (trigger, erreur) gardent leurs fichiers et leur entrée précédente.
+    """
+    options = {
+        "compact": api_config.get('compact', False),
+        "precompress": api_config.get('precompress', False)
+    }
+    previous = {m['title']: m for m in publisher.read_manga_list()}
+
+    api_list = []
+    changed = 0
+    for m_name in all_names: # Ordre de mangas.txt => sortie déterministe
+        data = db_store.get(m_name)
+        if data is None:
+            if m_name in previous: api_list.append(previous[m_name])
+            elif m_name in db_store: logger.warning(f"⚠️ {m_name} absent du JSON (erreur et pas d'ancienne version)")
+            continue
+        slug = manga_slug(m_name)
+        card = { "id": slug, "title": m_name, "cover": data['cover'] }
+        if 'cover_thumb' in data:
+            card.update(thumb=data['cover_thumb'], placeholder=data['cover_placeholder'])
+        api_list.append(card)
+        changed += publisher.publish_details(
+            slug, data, api_config.get('head_chapters', 30), api_config.get('page_size', 100), **options
+        )
+        manifests = {c['number']: storage.chapter_manifest(m_name, c['number']) for c in data['chapters'] if 'manifest' in c}
+        changed += publisher.publish_chapter_manifests(slug, manifests, **options)
+
+    changed += publisher.publish_manga_list(api_list, api_config.get('shard_size', 60), **options)
+    logger.info(f"📝 API : {changed} fichier(s) modifié(s)")
+
+def run_cycle(config, state, bot_scraper, all_names, trigger=None, trigger_scans=None, scheduled=False):
+    """
+    Un passage complet : ping/téléchargement, rétention, publication de l'API, manifest et état.
+    `scheduled` : ping périodique, limité aux mangas dont la fenêtre de sortie le justifie.
+    Retourne le rapport de métriques du passage (None si le trigger ne correspond à aucun manga).
+    """
+    metrics.reset()
+    tracked_names = all_names
     if trigger:
         name_map = {normalize_name(n): n for n in tracked_names}
         wanted = [name_map[t] for t in trigger if t in name_map]
         if not wanted:
             logger.info("⚠️ Aucun manga correspondant au trigger; arrêt.")
-            return
+            return None
         logger.info(f"🔔 Trigger: {', '.join(wanted)}")
         tracked_names = wanted
-    bot_scraper = scraper.MangaScraper(config)
-    BUCKET = storage.creds['bucket_name']
-    MAX_CHAPS = config.get('max_chapters', 0)
-
-    # 1. Gestion des Covers
-    logger.info("🖼️ Vérification des covers...")
-    covers_url_map = {}
-    for m in tracked_names:
-        url = storage.upload_cover(m)
-        if url: covers_url_map[m] = url
-        else: covers_url_map[m] = f"https://{B2_CLUSTER}.backblazeb2.com/file/{BUCKET}/mangas/{m}/cover.jpg"
 
-    # 2. ANALYSE DE L'ÉTAT ACTUEL (Le point crucial)
-    # On regarde ce qu'on a DÉJÀ sur B2 pour définir ce qu'on refuse de télécharger
+    # Un seul listing du bucket pour tout le run (existence, pages, rétention)
+    # ou aucun si le manifest commité est encore frais (ou l'inventaire déjà en mémoire en mode daemon)
     logger.info("📊 Analyse de l'existant sur Backblaze...")
-    manga_state = {}
+    storage.refresh_inventory(
+        max_age_hours=config.get('manifest_max_age_hours', 24),
+        spot_checks=config.get('manifest_spot_checks', 0),
+        spot_check_every=config.get('manifest_spot_check_every', 1)
+    )
 
-    for m_name in tracked_names:
-        existing = storage.list_chapters_on_b2(m_name)
-        existing.sort(key=sort_key) # Tri du plus vieux au plus récent (ex: 10, 11, 12)
-        
-        cutoff_value = -1.0
-        
-        # Si on a déjà atteint ou dépassé la limite (ex: 10 chapitres)
-        if MAX_CHAPS > 0 and len(existing) >= MAX_CHAPS:
-            # On définit la limite : tout ce qui est plus vieux que le 10ème en partant de la fin est IGNORÉ.
-            # ex: on a [1, 2... 40, 41, ... 50]. On garde les 10 derniers (41-50).
-            # Le cutoff devient 41. Tout ce qui est < 41 sur le site sera ignoré.
-            keep_list = existing[-MAX_CHAPS:] # Les 10 derniers
-            cutoff_value = sort_key(keep_list[0]) # Le plus petit des "gardés"
-            
-        manga_state[m_name] = {
-            "existing_chapters": set(existing),
-            "cutoff": cutoff_value
-        }
-        if cutoff_value > 0:
-            logger.info(f"   🛡️ {m_name} : Filtre activé. On ignore tout ce qui est < Chapitre {cutoff_value}")
+    # Calendrier des sorties : appris des dates d'upload, il décide quels mangas pinger
+    schedule_opts = schedule.options(config)
+    schedule.refresh(state, all_names, storage.get_inventory(), schedule_opts)
+    # Découverte par le flux : une seule requête (souvent un 304) pour tous les mangas, pas de calendrier
+    discovery = config.get('discovery', 'ping')
+    if scheduled and schedule_opts['enabled'] and not trigger and not trigger_scans and discovery != 'feed':
+        tracked_names = schedule.due(state, tracked_names)
+        logger.info(f"🗓️ {len(tracked_names)}/{len(all_names)} manga(s) à pinger selon le calendrier de sortie")
+    existing_before = {m: set(storage.list_chapters_on_b2(m)) for m in tracked_names}
 
-    # 3. Scan Site Source (ou mode direct via scan ID)
-    found_chapters = []
-    if trigger_scans:
+    # Mode direct via scan ID : les chapitres sont connus d'avance
+    forced = None
+    feed_cursor = None
+    if trigger_scans and tracked_names:
         logger.info("📡 Mode direct via scan ID...")
-        # Associe scans ↔ mangas (si un seul manga, on lui applique tous les scans)
-        if len(tracked_names) == 1:
-            for scan_id in trigger_scans:
-                c_num = "".join([c for c in scan_id if c.isdigit()]) or "0"
-                found_chapters.append({
-                    "manga_name": tracked_names[0],
-                    "author": "Inconnu",
-                    "scan_id": scan_id,
-                    "chapter_num": c_num,
-                    "chapter_title": ""
-                })
-        else:
-            for idx, scan_id in enumerate(trigger_scans):
-                manga_name = tracked_names[min(idx, len(tracked_names)-1)]
-                c_num = "".join([c for c in scan_id if c.isdigit()]) or "0"
-                found_chapters.append({
-                    "manga_name": manga_name,
-                    "author": "Inconnu",
-                    "scan_id": scan_id,
-                    "chapter_num": c_num,
-                    "chapter_title": ""
-                })
+        forced = {m: [] for m in tracked_names}
+        for chap in chapters_from_scans(tracked_names, trigger_scans):
+            forced[chap['manga_name']].append(chap)
+    elif discovery == 'feed' and tracked_names:
+        logger.info("📰 Découverte via le flux des sorties...")
+        found, feed_cursor = bot_scraper.get_latest_chapters_from_feed(
+            config.get('pages_to_scan', 5), tracked_names, state.get('feed')
+        )
+        forced = {m: [] for m in tracked_names}
+        for chap in found:
+            forced[chap['manga_name']].append(chap)
+        logger.info(f"📰 {len(found)} nouveau(x) chapitre(s) dans le flux")
     else:
         logger.info("📡 Ping du prochain chapitre...")
-        for m_name in tracked_names:
-            prefix = SCAN_PREFIX.get(m_name)
-            if not prefix:
-                logger.warning(f"⚠️ Prefix scan manquant pour {m_name}")
-                continue
-            current_state = manga_state.get(m_name, {})
-            existing = current_state.get("existing_chapters", [])
-            next_num = next_chapter_number(existing)
-            scan_id = f"{prefix}{next_num}"
-            if bot_scraper.scan_exists(scan_id):
-                found_chapters.append({
-                    "manga_name": m_name,
-                    "author": "Inconnu",
-                    "scan_id": scan_id,
-                    "chapter_num": str(next_num),
-                    "chapter_title": ""
-                })
-            else:
-                logger.info(f"⏭️ {m_name} {next_num} pas dispo")
-
-    # 4. Base de données pour le JSON final
+
+    # Un manga = une tâche. Le pool borne la concurrence globale,
+    # le scraper borne le nombre de requêtes simultanées vers le site source.
+    workers = max(1, config.get('manga_workers', 1))
     db_store = {}
-    for m in tracked_names:
-        db_store[m] = { "title": m, "author": "Inconnu", "cover": covers_url_map.get(m, ""), "chapters": [] }
+    to_delete = []
+    retries = state.setdefault('retry', {})
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        tasks = {
+            m: pool.submit(process_manga, m, bot_scraper, config, forced[m] if forced else None, retries.setdefault(m, {}))
+            for m in tracked_names
+        }
+        for m_name in tracked_names:
+            try:
+                db_store[m_name], chaps_to_kill = tasks[m_name].result()
+                to_delete += [(m_name, c) for c in chaps_to_kill]
+            except Exception as e:
+                # Un manga en erreur n'empêche pas les autres : on garde son ancien JSON
+                logger.error(f"❌ Erreur traitement {m_name} : {e}")
+                metrics.count("mangas_failed")
+                db_store[m_name] = None
 
-    # 5. TRAITEMENT INTELLIGENT
-    for chap in found_chapters:
-        m_name = chap['manga_name']
-        c_num = chap['chapter_num']
-        c_val = sort_key(c_num)
-        
-        if chap['author'] != "Inconnu": db_store[m_name]['author'] = chap['author']
+    for m_name in list(retries):
+        if not retries[m_name] or m_name not in all_names: del retries[m_name]
+    # Tête et validateurs du flux n'avancent que si TOUS les mangas suivis ont été traités : sinon (trigger
+    # partiel, manga en erreur) les sorties des autres mangas seraient sautées au prochain passage complet.
+    # Les marques (dernier scan vu par manga) des mangas traités avancent, elles, dans tous les cas.
+    if feed_cursor is not None:
+        done = [m for m in tracked_names if db_store[m] is not None]
+        if set(done) >= set(all_names):
+            state['feed'] = feed_cursor
+        else:
+            previous = state.get('feed') or {}
+            marks = dict(previous.get('marks', {}))
+            marks.update({m: feed_cursor['marks'][m] for m in done if m in feed_cursor['marks']})
+            state['feed'] = dict(previous, marks=marks)
 
-        # --- LE FILTRE ANTI-BOUCLE EST ICI ---
-        current_state = manga_state.get(m_name)
-        
-        # 1. Si le chapitre est trop vieux (inférieur au cutoff), ON ZAPPE IMMÉDIATEMENT
-        # Cela économise les transactions "Class C" car on ne vérifie même pas les fichiers
-        if current_state and current_state['cutoff'] > 0:
-            if c_val < current_state['cutoff']:
-                # logger.info(f"   ⛔ Trop vieux : {m_name} {c_num} (Ignoré)") # Décommenter pour debug
-                continue
+    # 6. NETTOYAGE FINAL (Retention Policy) : un seul listing et des suppressions en parallèle
+    if to_delete:
+        logger.info(f"🧹 Nettoyage final : {len(to_delete)} chapitre(s)...")
+        retention = config.get('retention', {})
+        report = storage.apply_retention(
+            to_delete, retention.get('mode', 'delete'), retention.get('dry_run', False), retention.get('workers', 8)
+        )
+        if report['errors']:
+            logger.warning(f"⚠️ {len(report['errors'])} fichier(s) non supprimé(s), nouvel essai au prochain run")
 
-        # 2. Si le chapitre est valide, on vérifie s'il faut le télécharger
-        existing_files = storage.list_files_in_chapter(m_name, c_num)
-        
-        if len(existing_files) < 1:
-            logger.info(f"🔎 Traitement : {m_name} {c_num}")
-            for filename, content in bot_scraper.download_images_generator(chap['scan_id']):
-                if filename not in existing_files:
-                    storage.upload_image(m_name, c_num, filename, content)
-                    logger.info(f"      ☁️ UP : {filename}")
-        
-        # On met à jour l'état local pour le nettoyage final
-        if current_state:
-            current_state['existing_chapters'].add(str(c_num))
-
-    # 6. NETTOYAGE FINAL (Retention Policy)
-    logger.info("🧹 Nettoyage final...")
-    for m_name in tracked_names:
-        # On reliste ce qu'on a maintenant (avec les nouveaux ajouts potentiels)
-        # Note: On utilise notre set en mémoire pour éviter un appel API B2 coûteux
-        all_chaps = list(manga_state[m_name]['existing_chapters'])
-        all_chaps.sort(key=sort_key)
-
-        # Logique de suppression
-        if MAX_CHAPS > 0 and len(all_chaps) > MAX_CHAPS:
-            nb_to_delete = len(all_chaps) - MAX_CHAPS
-            chaps_to_kill = all_chaps[:nb_to_delete] # Les plus vieux
-            chaps_to_keep = all_chaps[nb_to_delete:] # Les récents
-            
-            for old_chap in chaps_to_kill:
-                # Sécurité cover
-                if "cover" in str(old_chap).lower(): continue
-                
-                storage.delete_chapter_folder(m_name, old_chap)
-        else:
-            chaps_to_keep = all_chaps
-
-        # Construction JSON
-        for c_num in chaps_to_keep:
-            if "cover" in str(c_num).lower(): continue
-            
-            # Pour économiser les transactions, on n'appelle list_files que pour compter les pages
-            # Astuce : Si on vient de le scanner, on pourrait stocker le compte, 
-            # mais ici on fait un appel "Class C" léger pour être juste.
-            files = storage.list_files_in_chapter(m_name, c_num)
-            
-            folder_url = f"https://{B2_CLUSTER}.backblazeb2.com/file/{BUCKET}/mangas/{m_name}/{c_num}/"
-            db_store[m_name]['chapters'].append({
-                "number": c_num,
-                "title": f"Chapitre {c_num}",
-                "folder_url": folder_url,
-                "pages_count": len(files)
-            })
+    # Résultat des pings (un nouveau chapitre remet le backoff à zéro) et prochains pings
+    if forced is None:
+        for m_name in tracked_names:
+            if db_store.get(m_name) is not None:
+                schedule.record(state, m_name, bool(set(storage.list_chapters_on_b2(m_name)) - existing_before[m_name]))
+    plan = schedule.refresh(state, all_names, storage.get_inventory(), schedule_opts)
+    for m_name in all_names:
+        logger.info(f"🗓️ {m_name} : prochain ping {time.strftime('%Y-%m-%d %H:%M', time.localtime(plan[m_name]['next_probe']))}")
 
     # 7. GÉNÉRATION JSON
-    if not os.path.exists('api/details'): os.makedirs('api/details')
+    publish_api(db_store, all_names, config.get('api', {}))
 
-    api_list = []
-    for m_name, data in db_store.items():
-        slug = m_name.lower().replace(' ', '-')
-        api_list.append({ "id": slug, "title": m_name, "cover": data['cover'] })
-        
-        # Tri décroissant (récent en haut)
-        data['chapters'].sort(key=lambda x: sort_key(x['number']), reverse=True)
-        
-        with open(f'api/details/{slug}.json', 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-    
-    with open('api/mangas.json', 'w', encoding='utf-8') as f:
-        json.dump(api_list, f, indent=2, ensure_ascii=False)
+    # État du bucket pour le prochain run (commité avec api/)
+    storage.save_manifest()
+    save_state(state)
+
+    # Rapport de performance du run (JSON + Prometheus optionnel)
+    metrics_config = config.get('metrics', {})
+    report = metrics.write_report(
+        metrics_config.get('json_path', 'logs/run_metrics.json'),
+        metrics_config.get('prometheus_path') or None
+    )
+    tx = report['b2_transactions']
+    source_calls = sum(op['count'] for name, op in report['operations'].items() if name.startswith('source.'))
+    logger.info(f"⏱️ Run : {report['duration_seconds']}s, {source_calls} requêtes source, B2 A/B/C = {tx['A']}/{tx['B']}/{tx['C']}")
+    return report
+
+def main():
+    logger.info("🤖 --- DÉMARRAGE BOT (Smart Filter) ---")
+    config = load_config()
+    state = load_state()
+    if transcode.setup(config):
+        logger.info(f"🎨 Transcodage des pages en {transcode.page_ext()}")
+    resilience.setup(config)
+    bot_scraper = scraper.create_scraper(config, state)
+    storage.setup(config) # Pas de connexion B2 ici : elle a lieu au premier accès au bucket
+    try:
+        # Cron GitHub Actions : seuls les mangas dont la sortie est attendue sont pingés
+        scheduled = os.getenv("GITHUB_EVENT_NAME") == "schedule"
+        run_cycle(config, state, bot_scraper, load_mangas(), parse_trigger_mangas(), parse_trigger_scans(), scheduled)
+    finally:
+        bot_scraper.close()
+        transcode.shutdown()
 
     logger.info("✅ Terminé avec succès ! ")
 
+# --- MODE DAEMON ---
+# `python bot.py --daemon` : un seul processus garde la session du scraper, le client B2 et l'inventaire
+# chauds. Il pinge les mangas à intervalle adaptatif et reçoit des triggers sur un endpoint HTTP local :
+#   POST /trigger  {"manga": "One Piece", "scan": "OP1164"}   (mêmes formats que TRIGGER_MANGA / TRIGGER_SCAN)
+#   GET  /trigger?manga=One%20Piece&scan=OP1164
+#   GET  /health   => état du daemon (dernier cycle, prochain ping)
+# Si DAEMON_TOKEN est défini, les triggers doivent porter "Authorization: Bearer <token>".
+
+def _trigger_field(value):
+    """ Valeur d'un champ de trigger => chaîne au format des variables d'environnement """
+    if value is None: return ""
+    if isinstance(value, list) and len(value) == 1: value = value[0] # parse_qs
+    return value if isinstance(value, str) else json.dumps(value)
+
+class TriggerHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        logger.debug("🌐 " + fmt % args)
+
+    def _reply(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        token = os.getenv("DAEMON_TOKEN", "")
+        return not token or self.headers.get('Authorization', '') == f"Bearer {token}"
+
+    def _trigger(self, data):
+        if not self._authorized(): return self._reply(401, {"error": "unauthorized"})
+        item = {
+            "mangas": parse_trigger_mangas(_trigger_field(data.get('manga'))),
+            "scans": parse_trigger_scans(_trigger_field(data.get('scan')))
+        }
+        self.server.triggers.put(item)
+        self._reply(202, dict(item, queued=self.server.triggers.qsize()))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health': return self._reply(200, self.server.status)
+        if url.path == '/trigger': return self._trigger(parse_qs(url.query))
+        self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/trigger': return self._reply(404, {"error": "not found"})
+        raw = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8', 'replace')
+        try:
+            data = json.loads(raw) if raw.strip() else {}
+        except ValueError:
+            data = {"manga": raw} # Corps brut : "One Piece, Naruto"
+        self._trigger(data if isinstance(data, dict) else {"manga": data})
+
+def merge_triggers(items):
+    """
+    Regroupe les triggers en attente en cycles => [(mangas, scans, périodique), ...].
+    Les triggers sans scan sont fusionnés en un cycle ((None, None) si l'un d'eux demande un passage complet).
+    Seuls les pings périodiques ({"periodic": True}) suivent le calendrier : un trigger HTTP, même vide, force le passage.
+    Un trigger avec scans garde son propre cycle : ses scans sont associés à SES mangas par position
+    (chapters_from_scans), les mélanger enverrait les pages d'un manga dans le dossier d'un autre.
+    """
+    cycles = []
+    plain = [item for item in items if not item["scans"]]
+    if plain:
+        if any(not item["mangas"] for item in plain):
+            cycles.append((None, None, all(item.get("periodic") for item in plain)))
+        else:
+            mangas = []
+            for item in plain: mangas += [m for m in item["mangas"] if m not in mangas]
+            cycles.append((mangas, [], False))
+    cycles += [(item["mangas"], item["scans"], False) for item in items if item["scans"]]
+    return cycles
+
+def daemon():
+    logger.info("🤖 --- DÉMARRAGE BOT (daemon) ---")
+    config = load_config()
+    options = config.get('daemon', {})
+    min_interval = options.get('min_interval', 300)
+    max_interval = options.get('max_interval', 3600)
+
+    state = load_state()
+    if transcode.setup(config):
+        logger.info(f"🎨 Transcodage des pages en {transcode.page_ext()}")
+    resilience.setup(config)
+    bot_scraper = scraper.create_scraper(config, state)
+    storage.setup(config)
+
+    triggers = queue.Queue()
+    server = http.server.ThreadingHTTPServer((options.get('host', '127.0.0.1'), options.get('port', 8787)), TriggerHandler)
+    server.daemon_threads = True
+    server.triggers = triggers
+    server.status = {"cycles": 0, "last_cycle": None, "next_poll": None}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"🌐 Triggers sur http://{server.server_address[0]}:{server.server_address[1]}/trigger")
+
+    # SIGTERM (systemd, docker stop) : on termine le cycle en cours puis on sort proprement
+    signal.signal(signal.SIGTERM, lambda *args: triggers.put(None))
+
+    # Intervalle adaptatif : on se réveille au prochain ping prévu par le calendrier de sortie
+    # (sans calendrier : on repasse vite quand des chapitres sortent, on s'espace sinon)
+    scheduling = schedule.options(config)['enabled']
+    interval = min_interval
+    pending = [{"mangas": [], "scans": [], "periodic": True}] # Premier passage au démarrage
+    try:
+        while True:
+            if not pending:
+                if scheduling:
+                    wait = schedule.seconds_until_next(state, load_mangas())
+                    interval = max_interval if wait is None else min(max_interval, max(1, wait))
+                server.status["next_poll"] = int(time.time() + interval)
+                try:
+                    pending.append(triggers.get(timeout=interval))
+                except queue.Empty:
+                    pending.append({"mangas": [], "scans": [], "periodic": True}) # Ping périodique
+            # Les triggers arrivés pendant l'attente ou le cycle précédent sont traités ensemble
+            while not triggers.empty(): pending.append(triggers.get_nowait())
+            if None in pending: break
+            cycles = merge_triggers(pending)
+            pending = []
+            for trigger, trigger_scans, periodic in cycles:
+                try:
+                    report = run_cycle(config, state, bot_scraper, load_mangas(), trigger, trigger_scans, scheduled=periodic)
+                except Exception as e:
+                    logger.error(f"❌ Erreur cycle daemon : {e}")
+                    continue
+                server.status.update(cycles=server.status["cycles"] + 1, last_cycle=int(time.time()))
+                server.status["schedule"] = {m: e.get("next_probe") for m, e in state.get("schedule", {}).items()}
+                if report is not None and periodic and not scheduling:
+                    found = report['counters'].get('chapters_completed', 0)
+                    interval = min_interval if found else min(max_interval, interval * 2)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        bot_scraper.close()
+        transcode.shutdown()
+    logger.info("👋 Daemon arrêté")
+
 if __name__ == "__main__":
-    main()
-    
+    if "--daemon" in sys.argv[1:]:
+        daemon()
+    else:
+        main()
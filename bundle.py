@@ -0,0 +1,89 @@
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import zipfile
+
+# --- ARCHIVE PAR CHAPITRE (CBZ) ---
+# Un zip sans compression (ZIP_STORED : PNG/WebP sont déjà compressés) construit au fil des uploads.
+# Les workers finissent dans le désordre : les pages sont d'abord copiées dans un fichier de transit,
+# puis l'archive est écrite dans l'ordre des pages à la fin. Chaque page y est stockée telle quelle :
+# avec l'index des offsets, un client peut lire une page par requête HTTP Range, ou tout récupérer en un GET.
+
+DATE_TIME = (1980, 1, 1, 0, 0, 0) # Date fixe : même pages => même archive (même SHA-1, pas de ré-upload)
+LOCAL_HEADER = struct.Struct('<4s5H3L2H') # En-tête local zip (30 octets) : longueurs du nom et de l'extra à la fin
+CHUNK_SIZE = 64 * 1024
+
+class ChapterBundle:
+    """
+    CBZ d'un chapitre : les workers d'upload ajoutent leurs pages au fil de l'eau (add), l'archive est
+    écrite triée par nom de page (finish) : mêmes pages => mêmes octets, quel que soit l'ordre d'arrivée.
+    Après finish() : `path`, `size`, `sha1`, `index` ({page: [offset, taille]}) et open() comme un PageBody.
+    """
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix='mangariss-bundle-', suffix='.cbz')
+        os.close(fd)
+        fd, self._staging_path = tempfile.mkstemp(prefix='mangariss-bundle-')
+        self._staging = os.fdopen(fd, 'w+b')
+        self._entries = {} # {page: (position dans le fichier de transit, taille)}
+        self._lock = threading.Lock()
+        self.size = 0
+        self.sha1 = None
+        self.index = {}
+
+    def add(self, name, data):
+        """ Met une page de côté (bytes ou PageBody, copié en flux depuis son buffer ou son fichier temporaire) """
+        with self._lock:
+            position = self._staging.seek(0, os.SEEK_END)
+            if isinstance(data, (bytes, bytearray)):
+                self._staging.write(data)
+            else:
+                with data.open() as src: shutil.copyfileobj(src, self._staging, CHUNK_SIZE)
+            self._entries[name] = (position, self._staging.tell() - position)
+
+    def _write_archive(self):
+        with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_STORED) as archive:
+            for name in sorted(self._entries):
+                position, size = self._entries[name]
+                info = zipfile.ZipInfo(name, date_time=DATE_TIME)
+                info.compress_type = zipfile.ZIP_STORED
+                info.file_size = size
+                self._staging.seek(position)
+                with archive.open(info, 'w') as dst:
+                    while size > 0:
+                        chunk = self._staging.read(min(CHUNK_SIZE, size))
+                        dst.write(chunk)
+                        size -= len(chunk)
+            return archive.infolist()
+
+    def finish(self):
+        """ Écrit l'archive et calcule taille, SHA-1 et index des offsets (relu depuis les en-têtes locaux) """
+        with self._lock:
+            infos = self._write_archive()
+            self._staging.close()
+            os.remove(self._staging_path)
+        sha1 = hashlib.sha1()
+        with open(self.path, 'rb') as f:
+            for info in infos:
+                f.seek(info.header_offset)
+                header = LOCAL_HEADER.unpack(f.read(LOCAL_HEADER.size))
+                offset = info.header_offset + LOCAL_HEADER.size + header[-2] + header[-1]
+                self.index[info.filename] = [offset, info.file_size]
+            f.seek(0)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                sha1.update(chunk)
+        self.size = os.path.getsize(self.path)
+        self.sha1 = sha1.hexdigest()
+        return self
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def close(self):
+        """ Supprime les fichiers temporaires (l'archive est abandonnée si finish() n'a pas été appelé) """
+        with self._lock:
+            self._staging.close()
+            for path in (self.path, self._staging_path):
+                if os.path.exists(path): os.remove(path)
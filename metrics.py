@@ -0,0 +1,160 @@
+import json
+import math
+import publisher
+import threading
+import time
+from contextlib import contextmanager
+
+# --- INSTRUMENTATION DU RUN ---
+# Latences (histogrammes), octets transférés, retries et transactions B2 par classe.
+# Résumé JSON à la fin du run (+ fichier texte Prometheus optionnel).
+
+# Bornes des histogrammes de latence (secondes)
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Prix catalogue B2 (USD) au-delà du quota gratuit journalier, pour estimer le coût d'un run
+B2_PRICES = {"A": 0.0, "B": 0.004 / 10000, "C": 0.004 / 1000}
+
+_lock = threading.Lock()
+_ops = {}
+_counters = {}
+_b2 = {"A": 0, "B": 0, "C": 0}
+_started = time.time()
+
+def reset():
+    global _started
+    with _lock:
+        _ops.clear()
+        _counters.clear()
+        _b2.update({"A": 0, "B": 0, "C": 0})
+        _started = time.time()
+
+def _op(name):
+    op = _ops.get(name)
+    if op is None:
+        op = _ops[name] = {"count": 0, "errors": 0, "retries": 0, "bytes": 0, "seconds": 0.0, "buckets": [0] * (len(BUCKETS) + 1)}
+    return op
+
+def observe(name, seconds, nbytes=0, error=False):
+    """ Enregistre un appel : latence, octets transférés, erreur """
+    with _lock:
+        op = _op(name)
+        op["count"] += 1
+        op["seconds"] += seconds
+        op["bytes"] += nbytes or 0
+        if error: op["errors"] += 1
+        op["buckets"][next((i for i, b in enumerate(BUCKETS) if seconds <= b), len(BUCKETS))] += 1
+
+def retry(name):
+    with _lock: _op(name)["retries"] += 1
+
+def count(name, n=1):
+    """ Compteur libre (pages uploadées, chapitres traités...) """
+    with _lock: _counters[name] = _counters.get(name, 0) + n
+
+def b2_transaction(klass, n=1):
+    with _lock: _b2[klass] += n
+
+@contextmanager
+def timed(name):
+    """ with metrics.timed("source.GET") as call: ... ; call["bytes"] = len(data) """
+    call = {"bytes": 0}
+    start = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        observe(name, time.perf_counter() - start, call["bytes"], error=True)
+        raise
+    observe(name, time.perf_counter() - start, call["bytes"])
+
+class InstrumentedBucket:
+    """ Enveloppe un bucket b2sdk : chaque appel est chronométré et compté par classe de transaction """
+    CLASSES = {
+        "upload": "A", "upload_bytes": "A", "upload_local_file": "A", "upload_unbound_stream": "A", "delete_file_version": "A",
+        "get_file_info_by_name": "B",
+        "ls": "C", "update": "C"
+    }
+    LS_PAGE = 1000 # Un appel list_file_* de b2sdk renvoie 1000 fichiers par page (fetch_count par défaut)
+
+    def __init__(self, bucket):
+        self._bucket = bucket
+
+    def __getattr__(self, attr):
+        value = getattr(self._bucket, attr)
+        klass = self.CLASSES.get(attr)
+        if klass is None: return value
+        if attr == "ls": return self._ls(value)
+
+        def call(*args, **kwargs):
+            with timed(f"b2.{attr}") as c:
+                data = kwargs.get("data_bytes", args[0] if args and isinstance(args[0], bytes) else None)
+                if data is not None: c["bytes"] = len(data)
+                elif args and hasattr(args[0], "get_content_length"): c["bytes"] = args[0].get_content_length() or 0
+                b2_transaction(klass)
+                return value(*args, **kwargs)
+        return call
+
+    def _ls(self, ls):
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            n = 0
+            try:
+                for item in ls(*args, **kwargs):
+                    n += 1
+                    yield item
+            finally:
+                b2_transaction("C", max(1, math.ceil(n / self.LS_PAGE)))
+                observe("b2.ls", time.perf_counter() - start)
+        return call
+
+def summary():
+    """ Résumé du run (dict sérialisable) """
+    with _lock:
+        ops = {}
+        for name, op in sorted(_ops.items()):
+            ops[name] = dict(op, seconds=round(op["seconds"], 3), histogram=dict(
+                zip([str(b) for b in BUCKETS] + ["+Inf"], op["buckets"])
+            ))
+            del ops[name]["buckets"]
+        return {
+            "started_at": int(_started),
+            "duration_seconds": round(time.time() - _started, 3),
+            "operations": ops,
+            "counters": dict(sorted(_counters.items())),
+            "b2_transactions": dict(_b2),
+            "b2_estimated_cost_usd": round(sum(_b2[k] * B2_PRICES[k] for k in _b2), 6)
+        }
+
+def prometheus_text(data):
+    """ Format texte Prometheus (node_exporter textfile collector) """
+    lines = [
+        "# TYPE mangariss_run_duration_seconds gauge",
+        f"mangariss_run_duration_seconds {data['duration_seconds']}",
+        "# TYPE mangariss_run_timestamp_seconds gauge",
+        f"mangariss_run_timestamp_seconds {data['started_at']}",
+        "# TYPE mangariss_b2_transactions gauge"
+    ]
+    lines += [f'mangariss_b2_transactions{{class="{k}"}} {v}' for k, v in data["b2_transactions"].items()]
+    lines.append("# TYPE mangariss_counter gauge")
+    lines += [f'mangariss_counter{{name="{k}"}} {v}' for k, v in data["counters"].items()]
+    lines.append("# TYPE mangariss_call_seconds histogram")
+    for name, op in data["operations"].items():
+        total = 0
+        for bound, n in op["histogram"].items():
+            total += n
+            lines.append(f'mangariss_call_seconds_bucket{{op="{name}",le="{bound}"}} {total}')
+        lines.append(f'mangariss_call_seconds_sum{{op="{name}"}} {op["seconds"]}')
+        lines.append(f'mangariss_call_seconds_count{{op="{name}"}} {op["count"]}')
+    for field in ("errors", "retries", "bytes"):
+        lines.append(f"# TYPE mangariss_call_{field} gauge")
+        lines += [f'mangariss_call_{field}{{op="{name}"}} {op[field]}' for name, op in data["operations"].items()]
+    return "\n".join(lines) + "\n"
+
+def write_report(path='logs/run_metrics.json', prometheus_path=None):
+    """ Écrit le résumé JSON (et le fichier Prometheus si demandé). Retourne le résumé """
+    data = summary()
+    publisher.write_atomic(path, json.dumps(data, indent=2).encode('utf-8'))
+    if prometheus_path:
+        # Écriture atomique : le collecteur ne doit jamais lire un fichier à moitié écrit
+        publisher.write_atomic(prometheus_path, prometheus_text(data).encode('utf-8'))
+    return data
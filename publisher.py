@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+try:
+    import brotli # Optionnel : siblings .br seulement si le paquet est installé
+except ImportError:
+    brotli = None
+
+# --- ÉCRITURE DES FICHIERS API ---
+# Un fichier n'est réécrit que si son contenu change (comparaison SHA-1), et toujours
+# de façon atomique (fichier temporaire + rename) : pas de churn git, pas de JSON à moitié écrit.
+
+def dumps(data, compact=False):
+    if compact:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+
+def _sha1_file(path):
+    """ SHA-1 d'un fichier lu par blocs (covers, JSON publiés). None s'il n'existe pas """
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""): digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+def write_atomic(path, raw):
+    """ Écrit `raw` (bytes) dans `path` via un fichier temporaire du même dossier + rename """
+    folder = os.path.dirname(path) or '.'
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f: f.write(raw)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def _remove(path):
+    if os.path.exists(path): os.remove(path)
+
+def write_if_changed(path, raw, precompress=False):
+    """ Écrit `raw` seulement si le contenu diffère. Retourne True si le fichier a changé """
+    changed = hashlib.sha1(raw).hexdigest() != _sha1_file(path)
+    if changed:
+        write_atomic(path, raw)
+    if precompress:
+        # mtime=0 : le .gz est identique d'un run à l'autre si le JSON ne change pas
+        if changed or not os.path.exists(f"{path}.gz"):
+            write_atomic(f"{path}.gz", gzip.compress(raw, compresslevel=9, mtime=0))
+        if brotli is not None and (changed or not os.path.exists(f"{path}.br")):
+            write_atomic(f"{path}.br", brotli.compress(raw, quality=11))
+    else:
+        _remove(f"{path}.gz")
+        _remove(f"{path}.br")
+    return changed
+
+def write_json(path, data, compact=False, precompress=False):
+    """ Sérialise `data` et l'écrit si besoin. Retourne True si le fichier a changé """
+    return write_if_changed(path, dumps(data, compact), precompress)
+
+def read_json(path, default=None):
+    try:
+        with open(path, 'r', encoding='utf-8') as f: return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def _remove_json(path):
+    for suffix in ("", ".gz", ".br"): _remove(f"{path}{suffix}")
+
+def _remove_stale(folder, prefix, keep):
+    """ Supprime <prefix><k>.json pour k >= keep (pages ou shards devenus inutiles) """
+    if not os.path.isdir(folder): return
+    for name in os.listdir(folder):
+        stem = name.split('.json')[0]
+        if name.startswith(prefix) and stem[len(prefix):].isdigit() and int(stem[len(prefix):]) >= keep:
+            os.remove(os.path.join(folder, name))
+
+# --- MISE EN PAGE DE L'API (catalogues volumineux) ---
+# details/<slug>.json     : tête = les `head_size` chapitres les plus récents + nombre de pages d'archive
+# details/<slug>/p<k>.json : archives de `page_size` chapitres, p0 = les plus anciens. Numérotées depuis
+#                            le début pour que les pages déjà pleines ne changent plus d'un run à l'autre.
+# mangas.json             : index + premier shard ; mangas/<k>.json : shards suivants ; search.json : recherche
+
+API_DIR = 'api'
+
+def split_chapters(chapters, head_size, page_size):
+    """ `chapters` triés du plus récent au plus ancien => (tête, [pages d'archive, de la plus ancienne à la plus récente]) """
+    head = chapters[:head_size] if head_size > 0 else chapters
+    older = chapters[len(head):][::-1] # Du plus ancien au plus récent
+    pages = [older[i:i + page_size][::-1] for i in range(0, len(older), page_size)]
+    return head, pages
+
+def publish_details(slug, data, head_size=30, page_size=100, compact=False, precompress=False):
+    """ Écrit la tête et les pages d'archive d'un manga. Retourne le nombre de fichiers modifiés """
+    head, pages = split_chapters(data['chapters'], head_size, page_size)
+    doc = dict(data, chapters=head, chapters_total=len(data['chapters']), archive_pages=len(pages))
+    changed = write_json(f"{API_DIR}/details/{slug}.json", doc, compact, precompress)
+    folder = f"{API_DIR}/details/{slug}"
+    for k, page in enumerate(pages):
+        changed += write_json(f"{folder}/p{k}.json", {"page": k, "chapters": page}, compact, precompress)
+    _remove_stale(folder, "p", len(pages))
+    return changed
+
+def publish_chapter_manifests(slug, manifests, compact=False, precompress=False):
+    """ details/<slug>/chapters/<num>.json : pages exactes de chaque chapitre gardé (les autres sont supprimés) """
+    folder = f"{API_DIR}/details/{slug}/chapters"
+    changed = 0
+    for number, manifest in manifests.items():
+        changed += write_json(f"{folder}/{number}.json", manifest, compact, precompress)
+    if os.path.isdir(folder):
+        for name in os.listdir(folder):
+            if name.split('.json')[0] not in manifests:
+                os.remove(os.path.join(folder, name))
+    return changed
+
+def read_manga_list():
+    """ Relit la liste des mangas publiée (index + shards, ou ancien format liste) """
+    index = read_json(f"{API_DIR}/mangas.json", [])
+    if isinstance(index, list): return index
+    entries = list(index.get("mangas", []))
+    for k in range(1, index.get("shards", 1)):
+        entries += read_json(f"{API_DIR}/mangas/{k}.json", [])
+    return entries
+
+def publish_manga_list(entries, shard_size=60, compact=False, precompress=False):
+    """ Écrit l'index, les shards et l'index de recherche. Retourne le nombre de fichiers modifiés """
+    shard_size = max(1, shard_size)
+    shards = [entries[i:i + shard_size] for i in range(0, len(entries), shard_size)] or [[]]
+    index = {"total": len(entries), "shards": len(shards), "mangas": shards[0]}
+    if precompress: index["precompressed"] = True # Le lecteur ne tente les .gz que si l'index l'annonce
+    changed = write_json(f"{API_DIR}/mangas.json", index, compact, precompress)
+    for k in range(1, len(shards)):
+        changed += write_json(f"{API_DIR}/mangas/{k}.json", shards[k], compact, precompress)
+    _remove_stale(f"{API_DIR}/mangas", "", len(shards))
+    search = [{"id": m["id"], "title": m["title"], "shard": k} for k, shard in enumerate(shards) for m in shard]
+    changed += write_json(f"{API_DIR}/search.json", search, compact, precompress)
+    return changed
@@ -0,0 +1,165 @@
+import asyncio
+import email.utils
+import random
+import threading
+import time
+import requests
+import metrics
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# --- RÉSILIENCE (site source et B2) ---
+# Erreurs classées (transitoire = on réessaie, permanente = on abandonne tout de suite),
+# retries exponentiels avec jitter, respect de Retry-After, et un disjoncteur par hôte :
+# après `threshold` échecs transitoires d'affilée, l'hôte n'est plus sollicité pendant `cooldown` s.
+
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+policy = {
+    "attempts": 4,           # Tentatives par appel (1 = pas de retry)
+    "base_delay": 0.5,       # Backoff : base * 2^tentative, tiré au hasard entre 0 et cette valeur
+    "max_delay": 30.0,
+    "max_retry_after": 120.0, # Retry-After plus long = on abandonne l'appel (mieux vaut le prochain run)
+    "breaker_threshold": 5,
+    "breaker_cooldown": 30.0
+}
+
+class TransientError(Exception):
+    """ Erreur temporaire (429, 5xx, timeout...) : l'appel peut être réessayé """
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitOpenError(TransientError):
+    """ L'hôte est en panne (disjoncteur ouvert) : l'appel n'est même pas tenté """
+
+def setup(config):
+    policy.update(config.get('resilience') or {})
+    with _breakers_lock: _breakers.clear()
+
+def parse_retry_after(value):
+    """ En-tête Retry-After (secondes ou date HTTP) => secondes, ou None """
+    if not value: return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def check_status(r):
+    """ Lève TransientError si le statut HTTP justifie un retry (requests ou httpx) """
+    if r.status_code in RETRY_STATUS:
+        raise TransientError(f"HTTP {r.status_code} {r.url}", parse_retry_after(r.headers.get('Retry-After')))
+    return r
+
+def is_transient(exc):
+    if isinstance(exc, TransientError): return True
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)): return True
+    if httpx is not None and isinstance(exc, httpx.TransportError): return True
+    if isinstance(exc, (ConnectionError, TimeoutError, asyncio.TimeoutError)): return True
+    should_retry = getattr(exc, 'should_retry_http', None) # Exceptions b2sdk (B2Error)
+    return bool(should_retry and should_retry())
+
+def retry_after_of(exc):
+    value = getattr(exc, 'retry_after', None)
+    if value is None: value = getattr(exc, 'retry_after_seconds', None) # b2sdk TooManyRequests
+    return value
+
+def backoff(attempt, retry_after=None):
+    """ Délai avant la tentative suivante : full jitter, mais jamais moins que Retry-After """
+    delay = random.uniform(0, min(policy["max_delay"], policy["base_delay"] * 2 ** attempt))
+    return max(delay, retry_after or 0)
+
+class CircuitBreaker:
+    """ Fermé => ouvert après `threshold` échecs ; ouvert => un seul appel d'essai après `cooldown` s """
+    def __init__(self, host, threshold, cooldown):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+
+    def before(self):
+        with self._lock:
+            if self.opened_at is None: return
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0 or self.trial:
+                raise CircuitOpenError(f"{self.host} indisponible (disjoncteur ouvert)", max(remaining, 1.0))
+            self.trial = True # Demi-ouvert : cet appel décide de la réouverture
+
+    def success(self):
+        with self._lock:
+            self.failures, self.opened_at, self.trial = 0, None, False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial or self.failures >= self.threshold:
+                if self.opened_at is None or self.trial:
+                    metrics.count("circuit_opened")
+                self.opened_at, self.trial = time.monotonic(), False
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def breaker(host):
+    with _breakers_lock:
+        if host not in _breakers:
+            _breakers[host] = CircuitBreaker(host, policy["breaker_threshold"], policy["breaker_cooldown"])
+        return _breakers[host]
+
+def _give_up(exc, attempt):
+    """ Plus de tentative : erreur permanente, dernière tentative, ou Retry-After trop long """
+    if not is_transient(exc) or isinstance(exc, CircuitOpenError): return True
+    retry_after = retry_after_of(exc)
+    return attempt + 1 >= policy["attempts"] or (retry_after or 0) > policy["max_retry_after"]
+
+def call(fn, *args, name, host=None, **kwargs):
+    """ fn(*args, **kwargs) avec retries (erreurs transitoires seulement) et disjoncteur de `host` """
+    brk = breaker(host) if host else None
+    attempt = 0
+    while True:
+        if brk: brk.before()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if brk:
+                # Erreur permanente (404...) : l'hôte a répondu, l'essai demi-ouvert se termine aussi
+                if is_transient(e): brk.failure()
+                else: brk.success()
+            if _give_up(e, attempt): raise
+            metrics.retry(name)
+            time.sleep(backoff(attempt, retry_after_of(e)))
+            attempt += 1
+            continue
+        if brk: brk.success()
+        return result
+
+async def acall(fn, *args, name, host=None, **kwargs):
+    """ Version async de call() : `fn` est une coroutine function """
+    brk = breaker(host) if host else None
+    attempt = 0
+    while True:
+        if brk: brk.before()
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            if brk:
+                # Erreur permanente (404...) : l'hôte a répondu, l'essai demi-ouvert se termine aussi
+                if is_transient(e): brk.failure()
+                else: brk.success()
+            if _give_up(e, attempt): raise
+            metrics.retry(name)
+            await asyncio.sleep(backoff(attempt, retry_after_of(e)))
+            attempt += 1
+            continue
+        if brk: brk.success()
+        return result
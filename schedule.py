@@ -0,0 +1,104 @@
+import statistics
+import time
+
+# --- PLANIFICATION DES PINGS (calendrier de sortie) ---
+# Les mangas suivis sortent à rythme régulier (hebdo, mensuel...). L'historique des sorties est appris
+# des dates d'upload des chapitres dans l'inventaire B2 (gardé dans state.json au-delà de la rétention).
+# On pinge souvent dans la fenêtre de sortie attendue, et avec un backoff exponentiel en dehors.
+#
+# state["schedule"][manga] = {
+#     "releases": [epoch, ...],   # dates de sortie connues (les plus récentes)
+#     "last_probe": epoch, "misses": n,
+#     "expected": epoch | None, "next_probe": epoch   # calculés, exposés pour le suivi
+# }
+
+HISTORY = 20 # Sorties gardées par manga
+BURST = 3600 # Uploads à moins d'1h d'intervalle = un même lot (rattrapage), pas des sorties distinctes
+
+DEFAULTS = {
+    "enabled": True,
+    "min_interval": 600,    # Ping dans la fenêtre de sortie (et tant que le rythme est inconnu)
+    "max_interval": 86400,  # Backoff maximum hors fenêtre
+    "window_hours": 24      # Largeur minimale de la fenêtre autour de la sortie attendue
+}
+
+def options(config):
+    return dict(DEFAULTS, **(config.get('schedule') or {}))
+
+def release_times(manga_inventory):
+    """ Date de sortie (epoch) de chaque chapitre = premier upload de ses fichiers """
+    times = []
+    for chapter in (manga_inventory or {}).get("chapters", {}).values():
+        stamps = [meta["ts"] for meta in chapter.get("files", {}).values() if meta.get("ts")]
+        if stamps: times.append(min(stamps) / 1000)
+    return times
+
+def merge_releases(known, times):
+    """ Fusionne et regroupe les sorties (un lot d'uploads rapprochés = une sortie) """
+    merged = []
+    for t in sorted(set(known) | set(int(t) for t in times)):
+        if merged and t - merged[-1] < BURST: continue
+        merged.append(t)
+    return merged[-HISTORY:]
+
+def estimate(releases, window_hours=24):
+    """
+    Prochaine sortie attendue : (date, demi-largeur de fenêtre en s), ou (None, None) si moins de
+    deux sorties connues. Période = médiane des intervalles (robuste aux pauses et aux retards).
+    """
+    if len(releases) < 2: return None, None
+    gaps = [b - a for a, b in zip(releases, releases[1:])]
+    period = statistics.median(gaps)
+    spread = statistics.median(abs(g - period) for g in gaps)
+    half_width = max(window_hours * 1800, 2 * spread)
+    expected = releases[-1] + period
+    return expected, half_width
+
+def next_probe(entry, opts):
+    """ Date (epoch) du prochain ping d'un manga + date de sortie attendue """
+    last = entry.get("last_probe", 0)
+    backoff = min(opts["max_interval"], opts["min_interval"] * 2 ** entry.get("misses", 0))
+    expected, half_width = estimate(entry.get("releases", []), opts["window_hours"])
+    if expected is None:
+        return last + opts["min_interval"], None
+    start, end = expected - half_width, expected + half_width
+    if last + opts["min_interval"] >= end:
+        # Sortie en retard (pause, report) : backoff exponentiel compté depuis la fin de la fenêtre
+        # (les misses accumulés pendant la fenêtre sauteraient directement à max_interval)
+        late = min(opts["max_interval"], max(opts["min_interval"], last - end))
+        return last + late, expected
+    if last + opts["min_interval"] >= start:
+        return last + opts["min_interval"], expected # Dans la fenêtre : ping serré
+    return min(start, last + backoff), expected # Avant la fenêtre : on attend son ouverture
+
+def refresh(state, names, inventory, opts):
+    """ Met à jour l'historique et les prochains pings de chaque manga. Retourne state["schedule"] """
+    plan = state.setdefault("schedule", {})
+    for name in names:
+        entry = plan.setdefault(name, {})
+        entry["releases"] = merge_releases(entry.get("releases", []), release_times(inventory.get(name)))
+        entry["next_probe"], entry["expected"] = next_probe(entry, opts)
+        entry["next_probe"] = int(entry["next_probe"])
+        if entry["expected"] is not None: entry["expected"] = int(entry["expected"])
+    for name in list(plan):
+        if name not in names: del plan[name] # Manga retiré de mangas.txt
+    return plan
+
+def due(state, names, now=None):
+    """ Mangas dont le prochain ping est passé """
+    now = now or time.time()
+    plan = state.get("schedule", {})
+    return [n for n in names if plan.get(n, {}).get("next_probe", 0) <= now]
+
+def record(state, name, found, now=None):
+    """ Résultat d'un ping : un chapitre trouvé remet le backoff à zéro """
+    entry = state.setdefault("schedule", {}).setdefault(name, {})
+    entry["last_probe"] = int(now or time.time())
+    entry["misses"] = 0 if found else entry.get("misses", 0) + 1
+
+def seconds_until_next(state, names, now=None):
+    """ Attente avant le prochain ping dû (daemon) """
+    now = now or time.time()
+    plan = state.get("schedule", {})
+    times = [plan.get(n, {}).get("next_probe", 0) for n in names]
+    return max(0, min(times) - now) if times else None
@@ -1,14 +1,223 @@
+import asyncio
 import cloudscraper
-from bs4 import BeautifulSoup
+from lxml import html as lxml_html
 import time
-import random
+import re
 import logging
-from urllib.parse import urljoin
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+import metrics
+import resilience
+
+try:
+    import httpx # Moteur async optionnel (http_engine = "async")
+except ImportError:
+    httpx = None
 
 logger = logging.getLogger(__name__)
 
+MAX_PAGES = 200 # Sécurité : nombre max de pages par chapitre
+CHUNK_SIZE = 64 * 1024 # Lecture en flux du corps des pages
+
+class PageBody:
+    """
+    Corps d'une page téléchargée en flux : gardé en mémoire jusqu'à `spool` octets, puis déversé
+    dans un fichier temporaire. SHA-1 et taille sont calculés au fil de l'eau (pas de relecture pour l'upload).
+    """
+    def __init__(self, spool):
+        self.spool = spool
+        self.size = 0
+        self.path = None
+        self._buffer = bytearray()
+        self._file = None
+        self._sha1 = hashlib.sha1()
+
+    def write(self, chunk):
+        self._sha1.update(chunk)
+        self.size += len(chunk)
+        if self._file is None and self.size > self.spool:
+            fd, self.path = tempfile.mkstemp(prefix='mangariss-page-')
+            self._file = os.fdopen(fd, 'wb')
+            self._file.write(self._buffer)
+            self._buffer = bytearray()
+        if self._file is not None: self._file.write(chunk)
+        else: self._buffer += chunk
+
+    def finish(self):
+        if self._file is not None: self._file.close()
+        self._buffer = bytes(self._buffer)
+        return self
+
+    @property
+    def sha1(self):
+        return self._sha1.hexdigest()
+
+    def open(self):
+        """ Nouveau flux de lecture depuis le début (un par tentative d'upload) """
+        return open(self.path, 'rb') if self.path else io.BytesIO(self._buffer)
+
+    def read(self):
+        with self.open() as f: return f.read()
+
+    def close(self):
+        """ Supprime le fichier temporaire éventuel """
+        if self.path and os.path.exists(self.path): os.remove(self.path)
+        self._buffer = b""
+
+def discard_page(future):
+    """ Callback d'un téléchargement abandonné (futur ou tâche asyncio) : supprime la page reçue """
+    if future.cancelled() or future.exception() is not None: return
+    if future.result() is not None: future.result().close()
+
+# --- FLUX DES SORTIES (page d'accueil, du plus récent au plus ancien) ---
+FEED_LINKS = '//a[starts-with(@href, "?scan=")]' # Une carte par chapitre sorti
+
+def parse_feed(html):
+    """ Toutes les cartes d'une page du flux (lxml + XPath). Retourne None si la page est vide (fin du flux) """
+    if not html or not html.strip(): return None
+    links = lxml_html.fromstring(html).xpath(FEED_LINKS)
+    if not links: return None
+
+    cards = []
+    for link in links:
+        try:
+            # 1. Extraction MÉTADONNÉES : <p>Nom du manga <span>Auteur</span></p>
+            fig_p = link.find('.//figure/figcaption/p')
+            if fig_p is None: continue
+            author_tag = fig_p.find('span')
+            author = author_tag.text_content().strip() if author_tag is not None else "Inconnu"
+            manga_name = fig_p.text_content()
+            if author_tag is not None: manga_name = manga_name.replace(author_tag.text_content(), '', 1)
+
+            # Infos Chapitre
+            footer = link.find_class('sortiefooter')[0]
+            num_tag = footer.find('.//h3')
+            title_tag = footer.find('.//p')
+            cards.append({
+                'manga_name': manga_name.strip(),
+                'author': author,
+                'scan_id': link.get('href').split('=')[-1],
+                'chapter_num': num_tag.text_content().replace('#', '').strip(),
+                'chapter_title': title_tag.text_content().strip() if title_tag is not None else ""
+            })
+        except Exception as e:
+            logger.error(f"❌ Erreur parsing item : {e}")
+            continue
+    return cards
+
+class FeedScan:
+    """
+    Un passage incrémental sur le flux, à partir du curseur du passage précédent :
+    {"etag", "last_modified"} (GET conditionnel de la page 1), "head" (scan le plus récent déjà vu :
+    tout ce qui suit est connu, on arrête de paginer) et "marks" (dernier scan vu par manga).
+    """
+    def __init__(self, tracked_mangas_names, cursor=None):
+        self.tracked = set(tracked_mangas_names)
+        self.previous = cursor or {}
+        self.etag = self.previous.get("etag")
+        self.last_modified = self.previous.get("last_modified")
+        self.head = None
+        self.marks = {}
+        self.done = set() # Mangas dont la marque a été atteinte
+        self.chapters = []
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag: headers['If-None-Match'] = self.etag
+        if self.last_modified: headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def validators(self, headers):
+        self.etag = headers.get('ETag')
+        self.last_modified = headers.get('Last-Modified')
+
+    def add_page(self, html):
+        """ Ajoute les nouveautés d'une page. Retourne False s'il est inutile de lire la suivante """
+        cards = parse_feed(html)
+        if not cards: return False
+        known = self.previous.get("marks", {})
+        for card in cards:
+            if self.head is None: self.head = card['scan_id']
+            if card['scan_id'] == self.previous.get("head"): return False # La suite est déjà connue
+            name = card['manga_name']
+            if name not in self.tracked or name in self.done: continue
+            if card['scan_id'] == known.get(name):
+                self.done.add(name)
+                continue
+            self.marks.setdefault(name, card['scan_id'])
+            self.chapters.append(card)
+        return not self.tracked <= self.done
+
+    def cursor(self):
+        """ Curseur à enregistrer une fois les chapitres trouvés traités """
+        return {
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "head": self.head or self.previous.get("head"),
+            "marks": dict(self.previous.get("marks", {}), **self.marks)
+        }
+
+def endpoint_name(method, url, headers=None):
+    """ Nom de l'opération pour les métriques : source.probe / source.page / source.feed """
+    if method == 'HEAD' or 'Range' in (headers or {}): return "source.probe"
+    if urlparse(url).path.startswith("/files/scans/"): return "source.page"
+    return "source.feed"
+
+def response_size(r, streamed=False):
+    if streamed: return int(r.headers.get('Content-Length') or 0)
+    return len(r.content)
+
+FIRST_PAGE_NAMES = ("01.png", "1.png")
+
+def first_page_names(known, fallback=True):
+    """
+    Noms à tester pour la 1ère page : le nommage connu d'abord, l'autre seulement s'il manque.
+    fallback=False : le nommage connu seul (chapitres au-delà du prochain : un absent coûte une requête, pas deux)
+    """
+    if not known: return list(FIRST_PAGE_NAMES)
+    return [known] + [n for n in FIRST_PAGE_NAMES if n != known] if fallback else [known]
+
+def scan_prefix(scan_id):
+    """ Préfixe d'un scan ID (ex: OP1164 => OP) """
+    return re.match(r"[^\d]*", scan_id).group(0)
+
+class TokenBucket:
+    """
+    Limiteur à jetons (politesse envers le site source) : 1 jeton toutes les `interval` secondes,
+    rafales jusqu'à `capacity`. Partagé par les threads (wait) ou les coroutines (acquire).
+    """
+    def __init__(self, interval, capacity):
+        self.rate = 1.0 / interval if interval > 0 else float('inf')
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """ Réserve un jeton ; retourne l'attente (s) avant de pouvoir s'en servir """
+        if self.rate == float('inf'): return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate) - 1
+            self.updated = now
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait(self):
+        delay = self._reserve()
+        if delay: time.sleep(delay)
+
+    async def acquire(self):
+        delay = self._reserve()
+        if delay: await asyncio.sleep(delay)
+
 class MangaScraper:
-    def __init__(self, config):
+    def __init__(self, config, state=None):
         self.base_url = config['source_url']
         # Configuration Anti-Bot robuste
         self.scraper = cloudscraper.create_scraper(
@@ -18,127 +227,396 @@ class MangaScraper:
             'User-Agent': config['user_agent'],
             'Referer': self.base_url
         }
+        # Nombre de pages téléchargées en avance (1 = séquentiel)
+        self.download_window = config.get('download_window', 1)
+        # Au-delà de cette taille, une page téléchargée part dans un fichier temporaire (mémoire bornée)
+        self.spool = config.get('spool_kb', 1024) * 1024
+        # Limite de requêtes simultanées vers le site source (partagée par tous les mangas)
+        self._host_slots = threading.BoundedSemaphore(max(1, config.get('host_concurrency', 4)))
+        # Rythme des pages du flux (request_delay, rafales de rate_burst), partagé par tous les threads.
+        # Pages et sondes ne sont bornées que par host_concurrency (sinon le téléchargement parallèle ne sert à rien)
+        self.limiter = TokenBucket(config.get('request_delay', 1.0), config.get('rate_burst', 10))
+        # Nommage de la 1ère page par préfixe ({"OP": "01.png"}), gardé entre les runs via `state`
+        self.naming = (state if state is not None else {}).setdefault('naming', {})
+        self._head_supported = True
+
+    def _send(self, method, url, **kwargs):
+        """ Une tentative (flux au rythme du limiteur), dans la limite de connexions simultanées. 429/5xx => TransientError """
+        kwargs.setdefault('headers', self.headers)
+        name = endpoint_name(method, url, kwargs['headers'])
+        if name == "source.feed": self.limiter.wait()
+        with self._host_slots, metrics.timed(name) as call:
+            r = self.scraper.request(method, url, **kwargs)
+            call["bytes"] = 0 if method == 'HEAD' else response_size(r, kwargs.get('stream'))
+            try:
+                return resilience.check_status(r)
+            except resilience.TransientError:
+                r.close()
+                raise
+
+    def _request(self, method, url, **kwargs):
+        """ Requête vers le site source (retries + disjoncteur de l'hôte) """
+        name = endpoint_name(method, url, kwargs.get('headers', self.headers))
+        return resilience.call(self._send, method, url, name=name, host=urlparse(url).netloc, **kwargs)
+
+    def _get(self, url, **kwargs):
+        return self._request('GET', url, **kwargs)
 
-    def _sleep(self):
-        time.sleep(random.uniform(0.5, 1.5))
+    def close(self):
+        self.scraper.close()
 
-    def get_latest_chapters_from_feed(self, pages_to_scan, tracked_mangas_names):
-        found_chapters = []
-        
+    def get_latest_chapters_from_feed(self, pages_to_scan, tracked_mangas_names, cursor=None):
+        """
+        Nouveaux chapitres suivis du flux depuis le passage décrit par `cursor` (voir FeedScan).
+        Un flux inchangé coûte un seul 304. Retourne (chapitres, nouveau curseur).
+        """
+        scan = FeedScan(tracked_mangas_names, cursor)
         for page_num in range(1, pages_to_scan + 1):
             url = f"{self.base_url}/?p={page_num}"
             logger.info(f"🔍 Scan page : {url}")
-            
+            headers = dict(self.headers, **scan.conditional_headers()) if page_num == 1 else self.headers
             try:
-                response = self.scraper.get(url, headers=self.headers)
-                if response.status_code != 200: break
-                
-                soup = BeautifulSoup(response.text, 'html.parser')
-                links = soup.select('a[href^="?scan="]')
-                
-                if not links: break
-
-                for link in links:
-                    try:
-                        # 1. Extraction MÉTADONNÉES
-                        fig_p = link.select_one('figure figcaption p')
-                        if not fig_p: continue
-                        
-                        # Auteur
-                        author_tag = fig_p.find('span')
-                        author = author_tag.text.strip() if author_tag else "Inconnu"
-                        
-                        # Nom Manga
-                        if author_tag: author_tag.extract()
-                        manga_name = fig_p.text.strip()
-                        
-                        # Filtrage
-                        if manga_name not in tracked_mangas_names: continue
-
-                        # Infos Chapitre
-                        scan_id = link['href'].split('=')[-1]
-                        footer = link.select_one('.sortiefooter')
-                        num_tag = footer.find('h3')
-                        title_tag = footer.find('p')
-                        
-                        chapter_num = num_tag.text.replace('#', '').strip()
-                        chapter_title = title_tag.text.strip() if title_tag else ""
-                        
-                        found_chapters.append({
-                            'manga_name': manga_name,
-                            'author': author,
-                            'scan_id': scan_id,
-                            'chapter_num': chapter_num,
-                            'chapter_title': chapter_title
-                        })
-                        
-                    except Exception as e:
-                        logger.error(f"❌ Erreur parsing item : {e}")
-                        continue
+                response = self._get(url, headers=headers)
             except Exception as e:
                 logger.error(f"❌ Erreur connexion : {e}")
                 break
-            
-            self._sleep()
-            
-        return found_chapters
+            if response.status_code == 304:
+                logger.info("📰 Flux inchangé depuis le dernier passage")
+                break
+            if response.status_code != 200: break
+            if page_num == 1: scan.validators(response.headers)
+            if not scan.add_page(response.text): break
+        return scan.chapters, scan.cursor()
+
+    def _probe(self, url):
+        """ Test d'existence le moins cher possible : HEAD, sinon GET d'un seul octet (Range) """
+        if self._head_supported:
+            r = self._request('HEAD', url, timeout=10, allow_redirects=True)
+            r.close()
+            if r.status_code == 200: return True
+            if r.status_code in (404, 410): return False
+            # Serveur qui refuse HEAD : on passe au GET partiel pour la suite
+            self._head_supported = False
+        headers = dict(self.headers, Range='bytes=0-0')
+        r = self._get(url, headers=headers, timeout=10, stream=True)
+        r.close()
+        return r.status_code in (200, 206)
 
-    def scan_exists(self, scan_id):
-        """Retourne True si le scan existe (teste 01.png / 1.png)."""
+    def scan_exists(self, scan_id, fallback=True):
+        """
+        Retourne True si le scan existe (nommage déjà connu d'abord, puis l'autre : 01.png / 1.png).
+        fallback=False : seulement le nommage connu, s'il y en a un.
+        """
         base_img_url = f"{self.base_url}/files/scans/{scan_id}/"
-        for filename in ("01.png", "1.png"):
-            img_url = urljoin(base_img_url, filename)
-            r = None
-            try:
-                r = self.scraper.get(img_url, headers=self.headers, timeout=10, stream=True)
-                if r.status_code == 200:
-                    return True
-            except Exception as e:
-                logger.warning(f"      ⚠️ Erreur ping {scan_id}: {e}")
-            finally:
-                try:
-                    if r is not None:
-                        r.close()
-                except Exception:
-                    pass
+        prefix = scan_prefix(scan_id)
+        known = self.naming.get(prefix)
+        # Une erreur (après retries) est remontée : "injoignable" n'est pas "pas encore sorti"
+        for filename in first_page_names(known, fallback):
+            if self._probe(urljoin(base_img_url, filename)):
+                self.naming[prefix] = filename
+                return True
         return False
 
-    def download_images_generator(self, scan_id):
+    def probe_chapters(self, prefix, first, count):
+        """
+        Teste en parallèle les chapitres first, first+1... Retourne les numéros disponibles (triés).
+        Seul `first` essaie aussi l'autre nommage : un changement de nommage arrive avec le prochain chapitre.
+        """
+        nums = list(range(first, first + max(1, count)))
+        with ThreadPoolExecutor(max_workers=len(nums)) as pool:
+            found = list(pool.map(lambda n: self.scan_exists(f"{prefix}{n}", n == first), nums))
+        return [n for n, ok in zip(nums, found) if ok]
+
+    def _fetch_page(self, base_img_url, page_num):
+        """ Télécharge une page en flux. Retourne un PageBody, ou None si la page n'existe pas (404 = fin) """
+        filename = f"{page_num:02d}.png"
+        # Fallback 1.png si c'est la page 1
+        candidates = [filename, "1.png"] if page_num == 1 else [filename]
+        for name in candidates:
+            url = urljoin(base_img_url, name)
+            # Le corps est relu en entier à chaque tentative (coupure en cours de transfert incluse)
+            body = resilience.call(self._download, url, name="source.page", host=urlparse(url).netloc)
+            if body is not None:
+                return body
+        return None
+
+    def _download(self, url):
+        r = self._send('GET', url, timeout=10, stream=True)
+        try:
+            if r.status_code != 200: return None
+            body = PageBody(self.spool)
+            for chunk in r.iter_content(CHUNK_SIZE): body.write(chunk)
+            return body.finish()
+        finally:
+            r.close()
+
+    def download_images_generator(self, scan_id, window=None, start_page=1):
         """ 
         Générateur qui envoie les images une par une dès qu'elles sont téléchargées.
         Permet le traitement en temps réel.
+
+        `window` pages sont téléchargées en avance en parallèle (spéculatif) : les pages
+        sortent toujours dans l'ordre, et au plus `window` pages sont en attente.
+        Chaque page est un PageBody (en mémoire jusqu'à `spool_kb`, sur disque au-delà).
+        `start_page` permet de reprendre un chapitre interrompu.
+
+        Valeur de retour (StopIteration.value) : numéro de la dernière page si le chapitre
+        s'est terminé proprement sur un 404, None si on s'est arrêté sur une erreur.
         """
-        logger.info(f"📥 Démarrage analyse pour ID: {scan_id}")
-        page_num = 1
+        window = max(1, window or self.download_window)
+        logger.info(f"📥 Démarrage analyse pour ID: {scan_id} (fenêtre: {window}, page {start_page})")
         base_img_url = f"{self.base_url}/files/scans/{scan_id}/"
 
-        while True:
-            filename = f"{page_num:02d}.png"
-            img_url = urljoin(base_img_url, filename)
-            
+        pending = deque()
+        next_page = start_page
+        last_page = start_page - 1
+        with ThreadPoolExecutor(max_workers=window) as pool:
             try:
-                # Timeout court pour être réactif
-                r = self.scraper.get(img_url, headers=self.headers, timeout=10)
-                
-                if r.status_code == 200:
-                    # ✅ SUCCÈS : On envoie l'image tout de suite au bot
-                    yield (filename, r.content)
-                    
-                    page_num += 1
-                else:
-                    # Fallback 1.png si c'est la page 1
-                    if page_num == 1:
-                        alt_filename = "1.png"
-                        r_alt = self.scraper.get(urljoin(base_img_url, alt_filename), headers=self.headers)
-                        if r_alt.status_code == 200:
-                            yield ("01.png", r_alt.content)
-                            page_num += 1
-                            continue
-                    
+                while True:
+                    # On remplit la fenêtre de téléchargements spéculatifs
+                    while len(pending) < window and next_page <= MAX_PAGES:
+                        pending.append((next_page, pool.submit(self._fetch_page, base_img_url, next_page)))
+                        next_page += 1
+                    if not pending: break # Sécurité
+
+                    page_num, future = pending.popleft()
+                    try:
+                        content = future.result()
+                    except Exception as e:
+                        logger.warning(f"      ⚠️ Erreur téléchargement page {page_num} : {e}")
+                        return None
+
                     # 404 = Fin du chapitre
-                    break 
+                    if content is None: break
+
+                    # ✅ SUCCÈS : On envoie l'image tout de suite au bot
+                    yield (f"{page_num:02d}.png", content)
+                    last_page = page_num
+            finally:
+                # Les pages spéculatives au-delà de la fin sont abandonnées : annulées si elles n'ont pas
+                # commencé, sinon supprimées dès qu'elles arrivent (fichier temporaire du PageBody)
+                for _, future in pending:
+                    if not future.cancel(): future.add_done_callback(discard_page)
+        return last_page
+
+
+# --- MOTEUR ASYNC (http_engine = "async") ---
+# Connexions keep-alive (HTTP/2 si le serveur le supporte), même limiteur à jetons que le moteur sync
+# pour les pages du flux.
+# Les cookies anti-bot viennent de la session cloudscraper.
+
+class AsyncMangaScraper:
+    """ Équivalent async de MangaScraper (mêmes méthodes, en coroutines) """
+    def __init__(self, config, sync_scraper=None, state=None):
+        if httpx is None:
+            raise RuntimeError("http_engine 'async' : installer httpx[http2]")
+        self.base_url = config['source_url']
+        self.headers = {
+            'User-Agent': config['user_agent'],
+            'Referer': self.base_url
+        }
+        self.download_window = config.get('download_window', 1)
+        self.spool = config.get('spool_kb', 1024) * 1024
+        self.host_concurrency = max(1, config.get('host_concurrency', 4))
+        self.limiter = TokenBucket(config.get('request_delay', 1.0), config.get('rate_burst', 10))
+        # Session cloudscraper déjà existante (ou nouvelle) pour résoudre le challenge anti-bot
+        self.sync_scraper = sync_scraper or MangaScraper(config, state)
+        self.naming = self.sync_scraper.naming
+        self._head_supported = True
+        self.client = None
+        self._host_slots = None
+
+    async def start(self):
+        """ Résout le challenge via cloudscraper puis ouvre le pool de connexions avec ses cookies """
+        try:
+            await asyncio.to_thread(self.sync_scraper._get, self.base_url, timeout=20)
+        except Exception as e:
+            logger.warning(f"⚠️ Challenge anti-bot non résolu : {e}")
+        # En HTTP/2, une seule connexion multiplexe les requêtes : max_connections ne borne plus rien,
+        # le sémaphore garde la limite de requêtes simultanées vers l'hôte
+        self._host_slots = asyncio.Semaphore(self.host_concurrency)
+        limits = httpx.Limits(max_connections=self.host_concurrency, max_keepalive_connections=self.host_concurrency)
+        options = dict(headers=self.headers, cookies=self.sync_scraper.scraper.cookies, limits=limits, timeout=10)
+        try:
+            self.client = httpx.AsyncClient(http2=True, **options)
+        except ImportError:
+            # Paquet h2 absent : on reste en HTTP/1.1 (keep-alive quand même)
+            self.client = httpx.AsyncClient(**options)
+        return self
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _send(self, method, url, **kwargs):
+        name = endpoint_name(method, url, kwargs.get('headers'))
+        if name == "source.feed": await self.limiter.acquire()
+        async with self._host_slots:
+            with metrics.timed(name) as call:
+                r = await self.client.request(method, url, **kwargs)
+                call["bytes"] = 0 if method == 'HEAD' else response_size(r)
+                return resilience.check_status(r)
+
+    async def _request(self, method, url, **kwargs):
+        name = endpoint_name(method, url, kwargs.get('headers'))
+        return await resilience.acall(self._send, method, url, name=name, host=urlparse(url).netloc, **kwargs)
+
+    async def _get(self, url, **kwargs):
+        return await self._request('GET', url, **kwargs)
+
+    async def get_latest_chapters_from_feed(self, pages_to_scan, tracked_mangas_names, cursor=None):
+        scan = FeedScan(tracked_mangas_names, cursor)
+        for page_num in range(1, pages_to_scan + 1):
+            url = f"{self.base_url}/?p={page_num}"
+            logger.info(f"🔍 Scan page : {url}")
+            headers = scan.conditional_headers() if page_num == 1 else None
+            try:
+                response = await self._get(url, headers=headers)
             except Exception as e:
-                logger.warning(f"      ⚠️ Erreur téléchargement page {page_num} : {e}")
+                logger.error(f"❌ Erreur connexion : {e}")
+                break
+            if response.status_code == 304:
+                logger.info("📰 Flux inchangé depuis le dernier passage")
                 break
-            
-            if page_num > 200: break # Sécurité
\ No newline at end of file
+            if response.status_code != 200: break
+            if page_num == 1: scan.validators(response.headers)
+            if not scan.add_page(response.text): break
+        return scan.chapters, scan.cursor()
+
+    async def _probe(self, url):
+        """ HEAD, sinon GET d'un seul octet (Range) """
+        if self._head_supported:
+            r = await self._request('HEAD', url, follow_redirects=True)
+            if r.status_code == 200: return True
+            if r.status_code in (404, 410): return False
+            self._head_supported = False
+        r = await self._get(url, headers={'Range': 'bytes=0-0'})
+        return r.status_code in (200, 206)
+
+    async def scan_exists(self, scan_id, fallback=True):
+        """Retourne True si le scan existe (nommage déjà connu d'abord, puis l'autre : 01.png / 1.png)."""
+        base_img_url = f"{self.base_url}/files/scans/{scan_id}/"
+        prefix = scan_prefix(scan_id)
+        known = self.naming.get(prefix)
+        for filename in first_page_names(known, fallback):
+            if await self._probe(urljoin(base_img_url, filename)):
+                self.naming[prefix] = filename
+                return True
+        return False
+
+    async def probe_chapters(self, prefix, first, count):
+        """ Teste en parallèle les chapitres first, first+1... (l'autre nommage pour `first` seulement) """
+        nums = list(range(first, first + max(1, count)))
+        found = await asyncio.gather(*(self.scan_exists(f"{prefix}{n}", n == first) for n in nums))
+        return [n for n, ok in zip(nums, found) if ok]
+
+    async def _stream_page(self, url):
+        """ GET en flux vers un PageBody. None si la page n'existe pas """
+        return await resilience.acall(self._download, url, name="source.page", host=urlparse(url).netloc)
+
+    async def _download(self, url):
+        async with self._host_slots:
+            with metrics.timed(endpoint_name('GET', url, None)) as call:
+                async with self.client.stream('GET', url) as r:
+                    resilience.check_status(r)
+                    if r.status_code != 200: return None
+                    body = PageBody(self.spool)
+                    async for chunk in r.aiter_bytes(CHUNK_SIZE): body.write(chunk)
+                    call["bytes"] = body.size
+                    return body.finish()
+
+    async def _fetch_page(self, base_img_url, page_num):
+        filename = f"{page_num:02d}.png"
+        candidates = [filename, "1.png"] if page_num == 1 else [filename]
+        for name in candidates:
+            body = await self._stream_page(urljoin(base_img_url, name))
+            if body is not None:
+                return body
+        return None
+
+    async def download_images_generator(self, scan_id, window=None, start_page=1):
+        """
+        Générateur async : mêmes règles que la version synchrone (fenêtre spéculative,
+        ordre garanti, arrêt au premier 404). Une erreur réseau est relevée à l'appelant.
+        """
+        window = max(1, window or self.download_window)
+        logger.info(f"📥 Démarrage analyse pour ID: {scan_id} (fenêtre: {window}, page {start_page})")
+        base_img_url = f"{self.base_url}/files/scans/{scan_id}/"
+        pending = deque()
+        next_page = start_page
+        try:
+            while True:
+                while len(pending) < window and next_page <= MAX_PAGES:
+                    pending.append((next_page, asyncio.ensure_future(self._fetch_page(base_img_url, next_page))))
+                    next_page += 1
+                if not pending: break
+                page_num, task = pending.popleft()
+                content = await task
+                if content is None: break
+                yield (f"{page_num:02d}.png", content)
+        finally:
+            # Pas de cancel() : une requête annulée en plein flux laisse sa connexion bloquée dans le pool httpx.
+            # Les pages spéculatives se terminent et sont jetées à l'arrivée.
+            for _, task in pending:
+                task.add_done_callback(discard_page)
+
+class AsyncEngineScraper:
+    """
+    Façade synchrone du moteur async, utilisable telle quelle par bot.py :
+    une boucle asyncio tourne dans un thread dédié et garde le pool de connexions chaud.
+    """
+    def __init__(self, config, state=None):
+        self.engine = AsyncMangaScraper(config, state=state)
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self._run(self.engine.start())
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def close(self):
+        self._run(self.engine.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.engine.sync_scraper.close() # Session cloudscraper (challenge anti-bot)
+
+    def get_latest_chapters_from_feed(self, pages_to_scan, tracked_mangas_names, cursor=None):
+        return self._run(self.engine.get_latest_chapters_from_feed(pages_to_scan, tracked_mangas_names, cursor))
+
+    def scan_exists(self, scan_id, fallback=True):
+        return self._run(self.engine.scan_exists(scan_id, fallback))
+
+    def probe_chapters(self, prefix, first, count):
+        return self._run(self.engine.probe_chapters(prefix, first, count))
+
+    def download_images_generator(self, scan_id, window=None, start_page=1):
+        """ Même contrat que MangaScraper.download_images_generator (retourne la dernière page ou None) """
+        pages = self.engine.download_images_generator(scan_id, window, start_page)
+        last_page = start_page - 1
+        try:
+            while True:
+                try:
+                    filename, content = self._run(pages.__anext__())
+                except StopAsyncIteration:
+                    return last_page
+                yield (filename, content)
+                last_page += 1
+        except GeneratorExit:
+            raise
+        except Exception as e:
+            logger.warning(f"      ⚠️ Erreur téléchargement page {last_page + 1} : {e}")
+            return None
+        finally:
+            self._run(pages.aclose())
+
+def create_scraper(config, state=None):
+    """ Choisit le moteur HTTP selon config['http_engine'] ("sync" par défaut, ou "async") """
+    if config.get('http_engine', 'sync') == 'async':
+        return AsyncEngineScraper(config, state)
+    return MangaScraper(config, state)
@@ -1,6 +1,14 @@
 import b2sdk.v2 as b2
+import metrics
+import publisher
+import resilience
+import hashlib
 import json
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 def get_credentials():
     # Supporte Local ET GitHub Actions
@@ -12,87 +20,639 @@ def get_credentials():
         "bucket_name": os.environ.get("B2_BUCKET")
     }
 
-creds = get_credentials()
-info = b2.InMemoryAccountInfo()
-b2_api = b2.B2Api(info)
+B2_HOST = "b2" # Disjoncteur commun à tous les appels B2
 
-try:
-    b2_api.authorize_account("production", creds['application_key_id'], creds['application_key'])
-    bucket = b2_api.get_bucket_by_name(creds['bucket_name'])
-except Exception as e:
-    print(f"ERREUR B2 CRITIQUE: {e}")
-    exit(1)
+class Storage:
+    """
+    Client B2 paresseux : rien n'est fait à l'import, l'authentification n'a lieu qu'au premier
+    accès au bucket (un run "rien de nouveau" servi par le manifest ne parle jamais à B2).
+    - account_info : fichier SQLite b2sdk (token + id du bucket réutilisés d'un run à l'autre),
+      "" = en mémoire
+    - backend : objet exposant la surface de b2sdk.Bucket utilisée ici (ls, upload_bytes...),
+      utilisé tel quel à la place de B2 (bench, tests hors ligne)
+    """
+    def __init__(self, creds=None, account_info="", backend=None):
+        self.creds = creds or get_credentials()
+        self.account_info = account_info
+        self._backend = backend
+        self._api = None
+        self._bucket = None
+        self._lock = threading.Lock()
 
-def upload_image(manga_name, chapter_num, filename, image_bytes):
-    """ Upload : mangas/One Piece/1147/01.png """
-    b2_path = f"mangas/{manga_name}/{chapter_num}/{filename}"
+    @property
+    def bucket_name(self):
+        return self.creds['bucket_name']
+
+    @property
+    def connected(self):
+        return self._bucket is not None
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            with self._lock:
+                if self._bucket is None:
+                    # Chaque appel B2 est chronométré et compté par classe de transaction (A/B/C)
+                    self._bucket = metrics.InstrumentedBucket(self._backend or self._connect())
+        return self._bucket
+
+    def _connect(self):
+        """ Authentifie (sauf token encore en cache) et retourne le bucket b2sdk """
+        if self.account_info:
+            os.makedirs(os.path.dirname(self.account_info) or '.', exist_ok=True)
+            info = b2.SqliteAccountInfo(file_name=self.account_info)
+        else:
+            info = b2.InMemoryAccountInfo()
+        self._api = b2.B2Api(info, cache=b2.AuthInfoCache(info))
+        try:
+            cached = info.get_application_key_id() == self.creds['application_key_id']
+        except b2.exception.MissingAccountData:
+            cached = False
+        # Token en cache : b2sdk se ré-authentifie tout seul à son expiration (clé stockée dans le fichier)
+        try:
+            if not cached:
+                with metrics.timed("b2.authorize_account"):
+                    self._api.authorize_account("production", self.creds['application_key_id'], self.creds['application_key'])
+            # L'id du bucket est aussi en cache : pas de list_buckets (Class C) quand il est connu
+            return self._api.get_bucket_by_name(self.bucket_name)
+        except Exception as e:
+            print(f"ERREUR B2 CRITIQUE: {e}")
+            raise
+
+    def lifecycle_rules(self):
+        """ Règles de cycle de vie actuelles (lues sur B2 : le bucket en cache ne les porte pas) """
+        self.bucket # Connexion si besoin
+        if self._api is None:
+            return list(getattr(self._backend, "lifecycle_rules", None) or [])
+        metrics.b2_transaction("C")
+        found = self._api.list_buckets(bucket_name=self.bucket_name)
+        return list(found[0].lifecycle_rules or []) if found else []
+
+client = Storage()
+
+def setup(config):
+    """ Applique config['b2'] au client (avant la première connexion) """
+    opts = config.get('b2') or {}
+    client.account_info = os.path.expanduser(opts.get('account_info', ''))
+
+# --- INVENTAIRE DU BUCKET ---
+# Un seul listing de mangas/ par run, gardé en mémoire et mis à jour à chaque upload/suppression :
+# { manga: { "cover": meta, "chapters": { chapitre: { "files": { "01.png": meta } } } } }
+# meta = { "id": file_id, "size": octets, "sha1": content_sha1, "ts": upload_timestamp }
+_inventory = None
+_inventory_lock = threading.RLock()
+_reconciled_at = 0 # Date (epoch) du dernier listing complet du bucket
+_lifecycle = {} # Règles de cycle de vie posées par le bot : {préfixe: date (epoch)}, gardées dans le manifest
+_manifest_lock = threading.Lock() # Sauvegardes du manifest en série : une copie plus ancienne n'écrase jamais la dernière
+
+def _file_meta(file_version):
+    return {
+        "id": file_version.id_,
+        "size": file_version.size,
+        "sha1": file_version.content_sha1,
+        "ts": file_version.upload_timestamp
+    }
+
+def _manga_entry(inventory, manga_name):
+    return inventory.setdefault(manga_name, {"cover": None, "chapters": {}})
+
+def scan_bucket():
+    """ Liste tout mangas/ en une seule passe (Class C) et construit l'index en mémoire """
+    inventory = {}
+    count = 0
+    for file_version, _ in client.bucket.ls(folder_to_list="mangas/", recursive=True):
+        # Structure : mangas / One Piece / 1147 / 01.png  (ou mangas / One Piece / cover.jpg)
+        parts = file_version.file_name.split('/')
+        if len(parts) == 3 and parts[2] == COVER_THUMB:
+            _manga_entry(inventory, parts[1])["cover_thumb"] = _file_meta(file_version)
+        elif len(parts) == 3 and parts[2].startswith("cover."):
+            _manga_entry(inventory, parts[1])["cover"] = _file_meta(file_version)
+        elif len(parts) == 4:
+            chapters = _manga_entry(inventory, parts[1])["chapters"]
+            chapters.setdefault(parts[2], {"files": {}})["files"][parts[3]] = _file_meta(file_version)
+        count += 1
+    print(f"📦 Inventaire B2 : {count} fichiers, {len(inventory)} mangas")
+    return inventory
+
+# --- MANIFEST LOCAL ---
+# Copie de l'inventaire commitée avec api/ : un run "rien de nouveau" n'a plus besoin de lister le bucket.
+# Une réconciliation complète (listing réel) est faite périodiquement ou à la demande (B2_RECONCILE=1).
+MANIFEST_PATH = 'api/manifest.json'
+MANIFEST_VERSION = 1
+
+def _digest(data):
+    """ Empreinte stable d'une structure JSON (détection de dérive / corruption) """
+    raw = json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def load_manifest(path=MANIFEST_PATH):
+    """ Relit le manifest. Retourne None s'il est absent, d'un autre bucket ou corrompu """
+    if not os.path.exists(path): return None
     try:
-        bucket.upload_bytes(data_bytes=image_bytes, file_name=b2_path)
-        return b2_path
-    except:
+        with open(path, 'r', encoding='utf-8') as f: manifest = json.load(f)
+    except Exception as e:
+        print(f"⚠️ Manifest illisible ({e})")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("bucket") != client.bucket_name:
+        return None
+    if manifest.get("digest") != _digest(manifest.get("mangas", {})):
+        print("⚠️ Manifest modifié à la main ou corrompu (empreinte invalide)")
         return None
+    return manifest
 
-def upload_cover(manga_name):
-    """ Cherche une image dans le dossier local 'covers/' et l'upload """
+def save_manifest(path=MANIFEST_PATH):
+    """
+    Écrit l'inventaire courant dans le manifest (format compact et trié).
+    Appelé après chaque chapitre traité : un run tué en cours de route reprend où il en était.
+    """
+    with _manifest_lock:
+        with _inventory_lock:
+            if _inventory is None: return
+            mangas = _inventory
+            manifest = {
+                "version": MANIFEST_VERSION,
+                "bucket": client.bucket_name,
+                "reconciled_at": _reconciled_at,
+                "digest": _digest(mangas),
+                "mangas": mangas,
+                "lifecycle": _lifecycle
+            }
+            raw = json.dumps(manifest, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        # Écriture atomique : un run interrompu ne laisse jamais un manifest à moitié écrit
+        publisher.write_atomic(path, (raw + "\n").encode('utf-8'))
+
+LISTING_FIELDS = ("id", "size", "sha1", "ts") # Ce que donne un listing B2 (_file_meta), le reste est local
+
+def _listing_view(manga):
+    """ Un manga réduit aux champs du listing : complete, pages, dimensions... ne sont pas de la dérive """
+    if not manga: return None
+    strip = lambda meta: {k: meta[k] for k in LISTING_FIELDS if k in meta} if meta else None
+    return {
+        "cover": strip(manga.get("cover")),
+        "cover_thumb": strip(manga.get("cover_thumb")),
+        "chapters": {
+            c: {name: strip(meta) for name, meta in chapter["files"].items()}
+            for c, chapter in manga["chapters"].items()
+        }
+    }
+
+def report_drift(known, actual):
+    """ Compare deux inventaires manga par manga (fichiers listés seulement) et affiche ce qui a dérivé """
+    drifted = []
+    for manga_name in sorted(set(known) | set(actual)):
+        if _digest(_listing_view(known.get(manga_name))) != _digest(_listing_view(actual.get(manga_name))):
+            drifted.append(manga_name)
+            print(f"   🔀 Dérive détectée sur {manga_name}")
+    return drifted
+
+def spot_check(inventory, samples):
+    """
+    Vérifie quelques fichiers au hasard (Class B, bien moins cher qu'un listing).
+    Retourne False si un fichier du manifest a disparu ou changé sur B2.
+    """
+    files = [
+        (f"mangas/{m}/{c}/{name}", meta)
+        for m, manga in inventory.items()
+        for c, chapter in manga["chapters"].items()
+        for name, meta in chapter["files"].items()
+    ]
+    for b2_path, meta in random.sample(files, min(samples, len(files))):
+        try:
+            remote = client.bucket.get_file_info_by_name(b2_path)
+        except Exception:
+            return False
+        if remote.id_ != meta["id"]:
+            return False
+    return True
+
+def carry_local_fields(previous, inventory):
+    """
+    Recopie sur l'inventaire listé ce que seul le bot connaît (ext, pages, complete, dimensions, index
+    d'archive, placeholders) pour chaque fichier inchangé (même id). Un chapitre dont des pages ont
+    disparu perd son statut complet : il sera repris au prochain passage.
+    """
+    for manga_name, manga in inventory.items():
+        old = previous.get(manga_name)
+        if not old: continue
+        for key in ("cover", "cover_thumb"):
+            if manga.get(key) and (old.get(key) or {}).get("id") == manga[key]["id"]:
+                manga[key] = dict(old[key], **manga[key])
+        for c, chapter in manga["chapters"].items():
+            old_chapter = old["chapters"].get(c)
+            if not old_chapter: continue
+            for name, meta in chapter["files"].items():
+                old_meta = old_chapter["files"].get(name)
+                if old_meta and old_meta.get("id") == meta["id"]:
+                    chapter["files"][name] = dict(old_meta, **meta)
+            chapter.update({k: v for k, v in old_chapter.items() if k != "files"})
+            found = len([f for f in chapter["files"] if _is_page(f, chapter.get("ext", "png"))])
+            if chapter.get("pages") != found:
+                chapter.pop("complete", None)
+                chapter.pop("pages", None)
+    return inventory
+
+def load_inventory(manifest_path=MANIFEST_PATH, max_age_hours=24, spot_checks=0, force=False, spot_check_every=1):
+    """
+    Charge l'inventaire : depuis le manifest s'il est frais et cohérent,
+    sinon via un listing complet du bucket (réconciliation).
+    Les vérifications par sondage n'ont lieu qu'un run sur `spot_check_every` (tiré au sort, pas de compteur
+    à garder entre les runs) : elles obligent à s'authentifier sur B2 même quand rien n'a changé.
+    """
+    global _inventory, _reconciled_at
+    force = force or os.getenv("B2_RECONCILE", "").strip() in ("1", "true", "yes")
+    manifest = load_manifest(manifest_path)
+    if manifest:
+        with _inventory_lock:
+            for prefix, since in manifest.get("lifecycle", {}).items(): _lifecycle.setdefault(prefix, since)
+    if manifest and not force:
+        age = time.time() - manifest.get("reconciled_at", 0)
+        if max_age_hours > 0 and age > max_age_hours * 3600:
+            print(f"⏰ Manifest vieux de {age / 3600:.0f}h : réconciliation")
+        elif spot_checks and random.randrange(max(1, spot_check_every)) == 0 and not spot_check(manifest["mangas"], spot_checks):
+            print("🔀 Le manifest ne correspond plus au bucket : réconciliation")
+        else:
+            with _inventory_lock:
+                _inventory = manifest["mangas"]
+                _reconciled_at = manifest.get("reconciled_at", 0)
+            print(f"📒 Inventaire lu depuis le manifest ({len(_inventory)} mangas, 0 listing B2)")
+            return _inventory
+
+    inventory = scan_bucket()
+    if manifest:
+        report_drift(manifest["mangas"], inventory)
+    # Inventaire en mémoire (daemon) sinon manifest : les champs locaux survivent à la réconciliation
+    previous = _inventory if _inventory is not None else (manifest or {}).get("mangas")
+    if previous:
+        carry_local_fields(previous, inventory)
+    with _inventory_lock:
+        _inventory = inventory
+        _reconciled_at = int(time.time())
+    return inventory
+
+def refresh_inventory(max_age_hours=24, spot_checks=0, spot_check_every=1):
+    """
+    Charge l'inventaire s'il n'est pas encore en mémoire. Dans un processus qui dure (daemon),
+    il reste chaud entre deux cycles et n'est réconcilié que lorsqu'il devient trop vieux.
+    """
+    with _inventory_lock:
+        fresh = _inventory is not None and not (max_age_hours > 0 and time.time() - _reconciled_at > max_age_hours * 3600)
+        if fresh: return _inventory
+        return load_inventory(max_age_hours=max_age_hours, spot_checks=spot_checks, spot_check_every=spot_check_every)
+
+def get_inventory():
+    """ Retourne l'inventaire (chargé au premier appel) """
+    with _inventory_lock:
+        if _inventory is None:
+            load_inventory()
+        return _inventory
+
+def _chapter_entry(manga_name, chapter_num):
+    chapters = _manga_entry(get_inventory(), manga_name)["chapters"]
+    return chapters.setdefault(str(chapter_num), {"files": {}})
+
+def _find_chapter(manga_name, chapter_num):
+    """ Chapitre de l'inventaire sans le créer (un chapitre vide fausserait la rétention et le ping) """
+    manga = get_inventory().get(manga_name)
+    return manga["chapters"].get(str(chapter_num)) if manga else None
+
+# En-têtes Cache-Control servis par B2 : une page ne change jamais sous le même nom (même SHA-1 => pas
+# de ré-upload), la cover a une URL versionnée (?v=sha1) et le manifest de pages peut être complété.
+PAGE_CACHE = "public, max-age=31536000, immutable"
+MANIFEST_CACHE = "public, max-age=300"
+
+def upload_image(manga_name, chapter_num, filename, image, meta=None, cache_control=PAGE_CACHE):
+    """
+    Upload : mangas/One Piece/1147/01.png (ignoré si la même page, même SHA-1, est déjà sur B2).
+    Retourne le chemin B2 ; lève une exception si l'upload échoue malgré les retries.
+    `image` : bytes, ou corps de page en flux (scraper.PageBody : sha1, size, open()) envoyé
+    depuis son buffer ou son fichier temporaire sans être rechargé en mémoire.
+    `meta` (ex: dimensions {"w": 800, "h": 1200}) est gardé dans l'inventaire avec le fichier.
+    `cache_control` : en-tête Cache-Control servi par B2 (pages immuables par défaut).
+    """
+    b2_path = f"mangas/{manga_name}/{chapter_num}/{filename}"
+    streamed = not isinstance(image, (bytes, bytearray))
+    sha1 = image.sha1 if streamed else hashlib.sha1(image).hexdigest()
+    with _inventory_lock:
+        known = (_find_chapter(manga_name, chapter_num) or {"files": {}})["files"].get(filename)
+        if known and known.get("sha1") == sha1:
+            known.update(meta or {})
+            return b2_path
+    if streamed:
+        # Au-delà de la taille de part recommandée, b2sdk découpe lui-même en large file
+        source = b2.UploadSourceStream(image.open, stream_length=image.size, stream_sha1=sha1)
+        upload = lambda: client.bucket.upload(source, b2_path, cache_control=cache_control)
+    else:
+        upload = lambda: client.bucket.upload_bytes(data_bytes=image, file_name=b2_path, cache_control=cache_control)
+    # Les erreurs (après retries) remontent à l'appelant : la page sera retentée au prochain run
+    file_version = resilience.call(upload, name="b2.upload", host=B2_HOST)
+    with _inventory_lock:
+        _chapter_entry(manga_name, chapter_num)["files"][filename] = dict(_file_meta(file_version), **(meta or {}))
+    return b2_path
+
+def _is_page(filename, ext):
+    """ Page numérotée (01.webp), pas la miniature ni l'archive du chapitre """
+    stem, _, suffix = filename.partition('.')
+    return stem.isdigit() and suffix == ext
+
+# Manifest de pages d'un chapitre, uploadé à côté des images : mangas/One Piece/1147/pages.json
+CHAPTER_MANIFEST = "pages.json"
+
+def chapter_manifest(manga_name, chapter_num):
+    """ Liste exacte des pages d'un chapitre (fichier, taille, dimensions, SHA-1), depuis l'inventaire """
+    with _inventory_lock:
+        manga = get_inventory().get(manga_name)
+        chapter = manga["chapters"].get(str(chapter_num)) if manga else None
+        if not chapter: return None
+        ext = chapter.get("ext", "png")
+        pages = []
+        for name in sorted(chapter["files"]):
+            if not _is_page(name, ext): continue
+            meta = chapter["files"][name]
+            page = {"file": name, "size": meta["size"], "sha1": meta["sha1"]}
+            if "w" in meta: page.update(width=meta["w"], height=meta["h"])
+            original = f"{name.split('.')[0]}.png"
+            if ext != "png" and original in chapter["files"]:
+                page["original"] = original # PNG gardé (keep_original) : secours du lecteur
+            pages.append(page)
+        manifest = {"chapter": str(chapter_num), "ext": ext, "pages": pages}
+        bundle = chapter["files"].get(CHAPTER_BUNDLE)
+        if bundle and "index" in bundle:
+            # Position de chaque page dans l'archive : lecture par HTTP Range sans télécharger le reste
+            manifest["bundle"] = {"file": CHAPTER_BUNDLE, "size": bundle["size"], "sha1": bundle["sha1"]}
+            for page in pages:
+                if page["file"] in bundle["index"]:
+                    page["offset"] = bundle["index"][page["file"]][0]
+        return manifest
+
+def upload_chapter_manifest(manga_name, chapter_num):
+    """ Upload (si changé) le manifest de pages du chapitre sur B2 """
+    manifest = chapter_manifest(manga_name, chapter_num)
+    if not manifest or not manifest["pages"]: return None
+    raw = json.dumps(manifest, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return upload_image(manga_name, chapter_num, CHAPTER_MANIFEST, raw, cache_control=MANIFEST_CACHE)
+
+# Archive CBZ optionnelle du chapitre (toutes les pages, sans compression) : mangas/One Piece/1147/chapter.cbz
+CHAPTER_BUNDLE = "chapter.cbz"
+
+def upload_chapter_bundle(manga_name, chapter_num, bundle):
+    """ Upload l'archive du chapitre (bundle.ChapterBundle terminé) ; son index d'offsets est gardé dans l'inventaire """
+    return upload_image(manga_name, chapter_num, CHAPTER_BUNDLE, bundle, {"index": bundle.index})
+
+def chapter_bundle(manga_name, chapter_num, folder_url):
+    """
+    (URL versionnée de l'archive, taille) ou None. ?v=<sha1> comme la cover : l'archive est servie en immuable.
+    Une archive dont l'index a été perdu (inventaire reconstruit depuis B2) n'est pas annoncée.
+    """
+    with _inventory_lock:
+        manga = get_inventory().get(manga_name)
+        chapter = manga["chapters"].get(str(chapter_num)) if manga else None
+        meta = (chapter or {}).get("files", {}).get(CHAPTER_BUNDLE)
+        if not meta or "index" not in meta: return None
+        return f"{folder_url}{CHAPTER_BUNDLE}?v={meta['sha1'][:12]}", meta["size"]
+
+def is_chapter_complete(manga_name, chapter_num):
+    """ Un chapitre est complet quand son nombre de pages a été confirmé (fin propre sur 404) """
+    with _inventory_lock:
+        manga = get_inventory().get(manga_name)
+        chapter = manga["chapters"].get(str(chapter_num)) if manga else None
+        return bool(chapter and chapter.get("complete"))
+
+def mark_chapter_complete(manga_name, chapter_num, pages_count, ext="png"):
+    """ Marque le chapitre complet si B2 contient bien `pages_count` pages en .ext. Retourne True si c'est le cas """
+    if pages_count < 1: return False # Rien de téléchargé (scan pas encore sorti)
+    with _inventory_lock:
+        chapter = _find_chapter(manga_name, chapter_num)
+        found = len([f for f in chapter["files"] if _is_page(f, ext)]) if chapter else 0
+        if found != pages_count:
+            print(f"⚠️ {manga_name} {chapter_num} incomplet : {found}/{pages_count} pages")
+            return False
+        chapter["complete"] = True
+        chapter["pages"] = pages_count
+        chapter["ext"] = ext
+        return True
+
+def chapter_page_ext(manga_name, chapter_num):
+    """ Extension des pages d'un chapitre (png pour les anciens chapitres) """
+    with _inventory_lock:
+        manga = get_inventory().get(manga_name)
+        chapter = manga["chapters"].get(str(chapter_num)) if manga else None
+        return (chapter or {}).get("ext", "png")
+
+def chapter_pages_count(manga_name, chapter_num):
+    """ Nombre de pages d'un chapitre, sans appel B2 """
+    with _inventory_lock:
+        manga = get_inventory().get(manga_name)
+        chapter = manga["chapters"].get(str(chapter_num)) if manga else None
+        if not chapter: return 0
+        if "pages" in chapter: return chapter["pages"]
+        ext = chapter.get("ext", "png")
+        return len([f for f in chapter["files"] if _is_page(f, ext)])
+
+def cover_url(manga_name):
+    """ URL publique versionnée de la cover (?v=sha1) : une nouvelle cover change d'URL. None si inconnue """
+    with _inventory_lock:
+        manga = get_inventory().get(manga_name)
+        cover = manga and manga.get("cover")
+    if not cover: return None
+    # URL Publique (A adapter selon ton cluster f002/f004)
+    return f"https://f003.backblazeb2.com/file/{client.bucket_name}/mangas/{manga_name}/cover.jpg?v={cover['sha1'][:12]}"
+
+def local_cover(manga_name):
+    """ Cover du dossier local 'covers/' (jpg, png ou jpeg), ou None """
     for ext in ['.jpg', '.png', '.jpeg']:
         local_path = f"covers/{manga_name}{ext}"
-        if os.path.exists(local_path):
-            print(f"🖼️ Cover trouvée pour {manga_name}")
-            b2_path = f"mangas/{manga_name}/cover.jpg"
-            bucket.upload_local_file(local_file=local_path, file_name=b2_path)
-            # URL Publique (A adapter selon ton cluster f002/f004)
-            return f"https://f003.backblazeb2.com/file/{creds['bucket_name']}/{b2_path}"
+        if os.path.exists(local_path): return local_path
     return None
 
+def upload_cover(manga_name):
+    """ Cherche une image dans le dossier local 'covers/' et l'upload si elle a changé (SHA-1) """
+    local_path = local_cover(manga_name)
+    if local_path:
+        sha1 = publisher._sha1_file(local_path)
+        with _inventory_lock:
+            known = _manga_entry(get_inventory(), manga_name)["cover"]
+        if known and known.get("sha1") == sha1:
+            return cover_url(manga_name) # Inchangée : pas d'upload (ni transaction)
+        print(f"🖼️ Nouvelle cover pour {manga_name}")
+        b2_path = f"mangas/{manga_name}/cover.jpg"
+        file_version = resilience.call(
+            client.bucket.upload_local_file, local_file=local_path, file_name=b2_path,
+            cache_control=PAGE_CACHE, name="b2.upload", host=B2_HOST
+        )
+        with _inventory_lock:
+            _manga_entry(get_inventory(), manga_name)["cover"] = _file_meta(file_version)
+    return cover_url(manga_name)
+
+# --- APERÇUS (miniatures + placeholders floutés) ---
+# Miniature WebP de la cover (mangas/One Piece/cover-thumb.webp) et de la première page de chaque chapitre
+# (mangas/One Piece/1147/thumb.webp). Le placeholder (data URI de quelques centaines d'octets) est gardé
+# dans l'inventaire avec la miniature et publié tel quel dans le JSON.
+COVER_THUMB = "cover-thumb.webp"
+CHAPTER_THUMB = "thumb.webp"
+
+def cover_thumb_stale(manga_name):
+    """ True si la miniature de la cover manque ou a été faite depuis une autre cover """
+    with _inventory_lock:
+        manga = _manga_entry(get_inventory(), manga_name)
+        cover, thumb = manga["cover"], manga.get("cover_thumb")
+        return not (cover and thumb and thumb.get("source") == cover["sha1"] and "placeholder" in thumb)
+
+def upload_cover_thumb(manga_name, thumb, meta):
+    """ Upload (si changée) la miniature de la cover ; `meta` (placeholder, dimensions) va dans l'inventaire """
+    sha1 = hashlib.sha1(thumb).hexdigest()
+    with _inventory_lock:
+        manga = _manga_entry(get_inventory(), manga_name)
+        source = manga["cover"]["sha1"] if manga["cover"] else None
+        known = manga.get("cover_thumb")
+        if known and known.get("sha1") == sha1:
+            known.update(meta, source=source)
+            return
+    b2_path = f"mangas/{manga_name}/{COVER_THUMB}"
+    file_version = resilience.call(
+        client.bucket.upload_bytes, data_bytes=thumb, file_name=b2_path,
+        cache_control=PAGE_CACHE, name="b2.upload", host=B2_HOST
+    )
+    with _inventory_lock:
+        _manga_entry(get_inventory(), manga_name)["cover_thumb"] = dict(_file_meta(file_version), **meta, source=source)
+
+def cover_preview(manga_name):
+    """ {"thumb": URL versionnée, "placeholder": data URI} de la cover, ou None """
+    with _inventory_lock:
+        manga = get_inventory().get(manga_name)
+        thumb = manga and manga.get("cover_thumb")
+        if not thumb or "placeholder" not in thumb: return None
+        url = f"https://f003.backblazeb2.com/file/{client.bucket_name}/mangas/{manga_name}/{COVER_THUMB}?v={thumb['sha1'][:12]}"
+        return {"thumb": url, "placeholder": thumb["placeholder"]}
+
+def chapter_preview(manga_name, chapter_num, folder_url):
+    """ {"thumb", "placeholder"} de la première page d'un chapitre, ou None """
+    with _inventory_lock:
+        manga = get_inventory().get(manga_name)
+        chapter = manga["chapters"].get(str(chapter_num)) if manga else None
+        thumb = (chapter or {}).get("files", {}).get(CHAPTER_THUMB)
+        if not thumb or "placeholder" not in thumb: return None
+        return {"thumb": f"{folder_url}{CHAPTER_THUMB}?v={thumb['sha1'][:12]}", "placeholder": thumb["placeholder"]}
+
 def list_chapters_on_b2(manga_name):
     """ Liste quels numéros de chapitres existent déjà (Ignore cover.jpg) """
-    prefix = f"mangas/{manga_name}/"
-    chapters = set()
-    
-    # On utilise latest_only=True pour juste lister les dossiers actuels
-    for file_version, _ in bucket.ls(folder_to_list=prefix, recursive=True):
-        # Structure : mangas / One Piece / 1147 / 01.png
-        parts = file_version.file_name.split('/')
-        
-        # Sécurité : on vérifie qu'on est bien dans un sous-dossier
-        if len(parts) >= 3:
-            chap_name = parts[2]
-            
-            # 🛑 LE FIX EST ICI : On ignore explicitement cover.jpg
-            if chap_name == "cover.jpg" or chap_name.endswith(".jpg"):
-                continue
-                
-            chapters.add(chap_name)
-            
-    return list(chapters)
+    with _inventory_lock:
+        manga = get_inventory().get(manga_name)
+        return list(manga["chapters"]) if manga else []
 
 def list_files_in_chapter(manga_name, chapter_num):
     """ 
     Retourne la liste des fichiers (ex: ['01.png', '02.png']) présents sur B2 
     pour un chapitre donné.
     """
-    prefix = f"mangas/{manga_name}/{chapter_num}/"
-    files = set()
-    # On liste tout ce qui est dans ce dossier précis
+    with _inventory_lock:
+        manga = get_inventory().get(manga_name)
+        chapter = manga["chapters"].get(str(chapter_num)) if manga else None
+        return set(chapter["files"]) if chapter else set()
+
+# --- RÉTENTION ---
+# Toutes les suppressions d'un run en une fois : un seul listing des versions, puis suppressions
+# en parallèle avec retry. Mode "lifecycle" : on délègue la suppression à B2 (règles de cycle de vie).
+
+LIFECYCLE_MAX_RULES = 100 # Limite B2 par bucket
+LIFECYCLE_DAYS = 3 # Masquage (1 j) + suppression (1 j) + marge du passage quotidien de B2 : la règle a servi
+
+def _forget_chapter(manga_name, chapter_num):
+    with _inventory_lock:
+        manga = get_inventory().get(manga_name)
+        if manga: manga["chapters"].pop(str(chapter_num), None)
+
+def _delete_version(file_version):
+    """ Supprime une version (retries et disjoncteur B2). Retourne le message d'erreur, ou None """
     try:
-        for file_version, _ in bucket.ls(folder_to_list=prefix):
-            # file_name complet : mangas/One Piece/1147/01.png
-            # On veut juste : 01.png
-            clean_name = file_version.file_name.split('/')[-1]
-            files.add(clean_name)
-    except Exception:
-        # Si le dossier n'existe pas encore, c'est pas grave
-        pass
-    return files
+        resilience.call(
+            client.bucket.delete_file_version, file_version.id_, file_version.file_name,
+            name="b2.delete_file_version", host=B2_HOST
+        )
+    except Exception as e:
+        return str(e)
+
+def purge_chapters(targets, dry_run=False, workers=8):
+    """
+    Supprime toutes les versions des chapitres `targets` ([(manga, chapitre), ...]).
+    Retourne un rapport : {"chapters": {"manga/chapitre": nb versions}, "errors": [...], "dry_run": bool}
+    """
+    report = {"chapters": {}, "errors": [], "dry_run": dry_run}
+    if not targets: return report
+    wanted = {f"mangas/{m}/{c}/": (m, str(c)) for m, c in targets}
+
+    # 🛑 latest_only=False : on supprime aussi les anciennes versions (sinon elles restent facturées)
+    versions = []
+    for file_version, _ in client.bucket.ls(folder_to_list="mangas/", recursive=True, latest_only=False):
+        prefix = file_version.file_name.rsplit('/', 1)[0] + '/'
+        if prefix in wanted:
+            versions.append(file_version)
+            key = "/".join(wanted[prefix])
+            report["chapters"][key] = report["chapters"].get(key, 0) + 1
+
+    for key, count in sorted(report["chapters"].items()):
+        print(f"🗑️ NETTOYAGE : {key} ({count} versions){' [dry-run]' if dry_run else ''}")
+    if dry_run: return report
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        errors = pool.map(lambda fv: (fv.file_name, _delete_version(fv)), versions)
+        for file_name, error in errors:
+            if error:
+                print(f"   ⚠️ Erreur suppression fichier {file_name}: {error}")
+                report["errors"].append({"file": file_name, "error": error})
+
+    failed = {e["file"].rsplit('/', 1)[0] + '/' for e in report["errors"]}
+    for prefix, (m, c) in wanted.items():
+        if prefix not in failed: _forget_chapter(m, c)
+    metrics.count("versions_deleted", len(versions) - len(report["errors"]))
+    return report
+
+def schedule_lifecycle_deletion(targets, dry_run=False):
+    """
+    Mode "lifecycle" : ajoute une règle B2 par chapitre (masqué puis supprimé par B2 lui-même).
+    Une règle posée par le bot est retirée LIFECYCLE_DAYS jours après (chapitre supprimé) : sinon elle
+    masquerait aussi tout ce qui serait ré-uploadé sous ce préfixe. Max 100 règles par bucket.
+    Retourne False si le bucket ne peut pas être mis à jour (ex: clé sans writeBuckets).
+    """
+    if not targets: return True
+    now = int(time.time())
+    new_rules = [{
+        "fileNamePrefix": f"mangas/{m}/{c}/",
+        "daysFromUploadingToHiding": 1,
+        "daysFromHidingToDeleting": 1
+    } for m, c in targets]
+    current = client.lifecycle_rules()
+    others = [r for r in current if not r.get("fileNamePrefix", "").startswith("mangas/")]
+    known = {r["fileNamePrefix"] for r in new_rules}
+    with _inventory_lock:
+        # Règle sans date connue (manifest perdu) : comptée depuis maintenant, par prudence
+        since = {r["fileNamePrefix"]: _lifecycle.get(r["fileNamePrefix"], now) for r in current if r not in others}
+    done = {p for p, t in since.items() if now - t > LIFECYCLE_DAYS * 86400 and p not in known}
+    previous = [r for r in current if r not in others and r["fileNamePrefix"] not in known | done]
+    rules = (others + new_rules + previous)[:LIFECYCLE_MAX_RULES]
+    for rule in new_rules:
+        print(f"⏳ Cycle de vie B2 : {rule['fileNamePrefix']}{' [dry-run]' if dry_run else ''}")
+    for prefix in sorted(done):
+        print(f"✅ Cycle de vie B2 terminé, règle retirée : {prefix}{' [dry-run]' if dry_run else ''}")
+    if dry_run: return True
+    try:
+        client.bucket.update(lifecycle_rules=rules)
+    except Exception as e:
+        print(f"⚠️ Règles de cycle de vie refusées ({e})")
+        return False
+    with _inventory_lock:
+        kept = {r["fileNamePrefix"] for r in rules}
+        _lifecycle.clear()
+        _lifecycle.update({p: since.get(p, now) for p in kept - known if p.startswith("mangas/")})
+        _lifecycle.update({p: now for p in known})
+    for m, c in targets: _forget_chapter(m, c)
+    return True
+
+def apply_retention(targets, mode="delete", dry_run=False, workers=8):
+    """ Point d'entrée de la rétention : cycle de vie B2 si demandé (et possible), sinon suppression directe """
+    if mode == "lifecycle" and schedule_lifecycle_deletion(targets, dry_run):
+        return {"chapters": {f"{m}/{c}": "lifecycle" for m, c in targets}, "errors": [], "dry_run": dry_run}
+    return purge_chapters(targets, dry_run, workers)
 
 def delete_chapter_folder(manga_name, chapter_num):
     """ Supprime tous les fichiers d'un chapitre spécifique sur B2 """
-    prefix = f"mangas/{manga_name}/{chapter_num}/"
-    print(f"🗑️ NETTOYAGE : Suppression du vieux chapitre {manga_name} {chapter_num}...")
-    
-    # 🛑 LE FIX EST ICI : latest_only=False (au lieu de show_versions=True)
-    for file_version, _ in bucket.ls(folder_to_list=prefix, recursive=True, latest_only=False):
-        try:
-            bucket.delete_file_version(file_version.id_, file_version.file_name)
-        except Exception as e:
-            print(f"   ⚠️ Erreur suppression fichier {file_version.file_name}: {e}")
\ No newline at end of file
+    return purge_chapters([(manga_name, chapter_num)])
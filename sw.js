@@ -0,0 +1,151 @@
+// --- SERVICE WORKER DU LECTEUR ---
+// Pages (B2, immuables) : cache d'abord, avec éviction LRU bornée en octets (stockage mobile limité).
+// JSON de l'API : stale-while-revalidate (affichage immédiat, mise à jour en arrière-plan).
+// Le lecteur peut demander le préchargement de pages (chapitre suivant) par message.
+// ⚠️ Le bucket B2 doit autoriser CORS (GET depuis l'origine du lecteur) : une réponse opaque (no-cors)
+// compte pour plusieurs Mo dans le quota du navigateur et sa taille est illisible, elle n'est donc jamais
+// mise en cache (la page s'affiche quand même, via le cache HTTP).
+
+const VERSION = 'v2'; // v1 pouvait contenir des réponses opaques : supprimé à l'activation
+const PAGES_CACHE = `mangacloud-pages-${VERSION}`;
+const API_CACHE = `mangacloud-api-${VERSION}`;
+const LRU_KEY = './__lru__.json'; // Index LRU des pages { url: [taille, dernier accès] }, gardé dans le cache
+
+const MAX_PAGES_BYTES = 200 * 1024 * 1024;
+const MAX_API_ENTRIES = 300;
+const UNKNOWN_SIZE = 512 * 1024; // Taille comptée sans Content-Length (ou pour un index LRU perdu)
+const PAGE_RE = /\/file\/.+\.(png|webp|avif|jpe?g)$/i;
+
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', event => event.waitUntil((async () => {
+    // Anciennes versions du cache supprimées
+    for (const name of await caches.keys()) {
+        if (name.startsWith('mangacloud-') && ![PAGES_CACHE, API_CACHE].includes(name)) await caches.delete(name);
+    }
+    await self.clients.claim();
+})()));
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET' || request.headers.has('range')) return; // Range (archive CBZ) : réseau direct
+    const url = new URL(request.url);
+    if (PAGE_RE.test(url.pathname)) event.respondWith(cacheFirst(request.url, event));
+    else if (url.origin === self.location.origin && url.pathname.includes('/api/')) event.respondWith(staleWhileRevalidate(request, event));
+});
+
+self.addEventListener('message', event => {
+    if (event.data && event.data.type === 'prefetch') event.waitUntil(prefetch(event.data.urls || []));
+});
+
+// 1. Pages : cache d'abord
+let corsEnabled = true; // Passe à false au premier échec CORS : plus de double requête ensuite
+
+async function fetchPage(url) {
+    if (!corsEnabled) return fetch(url, { mode: 'no-cors' });
+    try { return await fetch(url, { mode: 'cors', credentials: 'omit' }); }
+    catch(e) {
+        // Même URL en no-cors : si elle passe, c'était bien CORS (sinon simple coupure réseau, on garde CORS)
+        const res = await fetch(url, { mode: 'no-cors' });
+        corsEnabled = false;
+        return res;
+    }
+}
+
+async function cacheFirst(url, event) {
+    const cache = await caches.open(PAGES_CACHE);
+    const hit = await cache.match(url);
+    if (hit) {
+        event.waitUntil(touch(url));
+        return hit;
+    }
+    const res = await fetchPage(url);
+    if (res.ok) event.waitUntil(store(cache, url, res.clone())); // Jamais de réponse opaque (voir en tête)
+    return res;
+}
+
+async function prefetch(urls) {
+    const cache = await caches.open(PAGES_CACHE);
+    for (const url of urls) {
+        if (await cache.match(url)) continue;
+        try {
+            const res = await fetchPage(url);
+            if (res.ok) await store(cache, url, res);
+        } catch(e) { /* hors ligne : tant pis, la page sera chargée à la lecture */ }
+    }
+}
+
+// 2. Éviction LRU : l'index est en mémoire, recréé depuis le cache au réveil du service worker
+let lru = null;
+let saving = null;
+
+async function loadLru(cache) {
+    if (lru) return lru;
+    const saved = await cache.match(LRU_KEY);
+    lru = saved ? await saved.json() : {};
+    if (!saved) { // Index perdu : les pages déjà en cache sont les plus anciennes
+        for (const request of await cache.keys()) {
+            if (!request.url.endsWith(LRU_KEY.slice(1))) lru[request.url] = [UNKNOWN_SIZE, 0];
+        }
+    }
+    return lru;
+}
+
+function persist(cache) {
+    // Écriture de l'index regroupée (une par seconde au plus)
+    if (!saving) {
+        saving = new Promise(resolve => setTimeout(resolve, 1000)).then(() => {
+            saving = null;
+            return cache.put(LRU_KEY, new Response(JSON.stringify(lru), { headers: { 'Content-Type': 'application/json' } }));
+        });
+    }
+    return saving;
+}
+
+async function touch(url) {
+    const cache = await caches.open(PAGES_CACHE);
+    const index = await loadLru(cache);
+    if (index[url]) index[url][1] = Date.now();
+    return persist(cache);
+}
+
+async function store(cache, url, res) {
+    const size = Number(res.headers.get('Content-Length')) || UNKNOWN_SIZE;
+    await cache.put(url, res);
+    const index = await loadLru(cache);
+    index[url] = [size, Date.now()];
+    await evict(cache, index);
+    return persist(cache);
+}
+
+async function evict(cache, index) {
+    let total = Object.values(index).reduce((sum, [size]) => sum + size, 0);
+    if (total <= MAX_PAGES_BYTES) return;
+    // On descend à 90 % du budget : pas d'éviction à chaque nouvelle page
+    const oldest = Object.entries(index).sort((a, b) => a[1][1] - b[1][1]);
+    for (const [url, [size]] of oldest) {
+        if (total <= MAX_PAGES_BYTES * 0.9) break;
+        await cache.delete(url);
+        delete index[url];
+        total -= size;
+    }
+}
+
+// 3. API : stale-while-revalidate (borné en nombre d'entrées, les plus anciennes mises à jour partent d'abord)
+async function staleWhileRevalidate(request, event) {
+    const cache = await caches.open(API_CACHE);
+    const cached = await cache.match(request);
+    const network = fetch(request).then(async res => {
+        if (res.ok) {
+            await cache.put(request, res.clone());
+            const keys = await cache.keys();
+            for (const key of keys.slice(0, Math.max(0, keys.length - MAX_API_ENTRIES))) await cache.delete(key);
+        }
+        return res;
+    });
+    if (cached) {
+        event.waitUntil(network.catch(() => {}));
+        return cached;
+    }
+    return network;
+}
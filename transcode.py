@@ -0,0 +1,120 @@
+import base64
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageFilter
+
+# --- TRANSCODAGE DES PAGES (PNG => WebP/AVIF) ---
+# Optionnel (config['transcode']['enabled']). L'encodage est coûteux en CPU : il tourne
+# sur un pool de processus pour utiliser tous les cœurs du runner.
+
+options = None
+_pool = None
+# Processus lancés en "spawn" : un fork du bot (threads d'upload, boucle asyncio) peut copier un verrou
+# tenu par un autre thread et bloquer l'enfant pour toujours
+_context = multiprocessing.get_context("spawn")
+
+# Aperçus (config['previews']) : miniature + placeholder flouté, sur leur propre pool de processus
+previews = None
+_preview_pool = None
+
+def setup(config):
+    """ Prépare les pools (transcodage, aperçus) selon la config. Retourne True si le transcodage est actif """
+    global options, _pool, previews, _preview_pool
+    preview_opts = config.get('previews') or {}
+    if preview_opts.get('enabled'):
+        previews = {
+            "thumb_width": preview_opts.get('thumb_width', 260),
+            "quality": preview_opts.get('quality', 70),
+            "placeholder_width": preview_opts.get('placeholder_width', 16)
+        }
+        _preview_pool = ProcessPoolExecutor(max_workers=preview_opts.get('workers') or os.cpu_count(), mp_context=_context)
+    opts = config.get('transcode') or {}
+    if not opts.get('enabled'):
+        return False
+    options = {
+        "format": opts.get('format', 'webp').lower(),
+        "quality": opts.get('quality', 80),
+        "max_width": opts.get('max_width', 0),
+        "keep_original": opts.get('keep_original', False)
+    }
+    _pool = ProcessPoolExecutor(max_workers=opts.get('workers') or os.cpu_count(), mp_context=_context)
+    return True
+
+def shutdown():
+    global _pool, _preview_pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+    if _preview_pool is not None:
+        _preview_pool.shutdown()
+        _preview_pool = None
+
+def page_ext():
+    """ Extension des pages uploadées ("png" sans transcodage) """
+    return options["format"] if _pool is not None else "png"
+
+def encode(data, fmt, quality, max_width):
+    """ Ré-encode une image (exécuté dans un processus du pool) """
+    img = Image.open(io.BytesIO(data))
+    if max_width and img.width > max_width:
+        height = round(img.height * max_width / img.width)
+        img = img.resize((max_width, height), Image.LANCZOS)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+    out = io.BytesIO()
+    img.save(out, format=fmt.upper(), quality=quality)
+    return out.getvalue()
+
+def make_preview(data, thumb_width, quality, placeholder_width):
+    """
+    Miniature WebP (largeur `thumb_width`, haut de l'image si elle est très haute) et placeholder flouté
+    de `placeholder_width` px en data URI. Exécuté dans un processus du pool. Retourne (bytes, meta)
+    """
+    img = Image.open(io.BytesIO(data))
+    img.draft("RGB", (thumb_width, thumb_width)) # JPEG : décodage directement à taille réduite
+    img = img.convert("RGB")
+    height = round(img.height * thumb_width / img.width)
+    thumb = img.resize((thumb_width, height), Image.LANCZOS)
+    thumb = thumb.crop((0, 0, thumb_width, min(height, thumb_width * 3 // 2))) # Pas plus haut qu'une carte 2:3
+    out = io.BytesIO()
+    thumb.save(out, format="WEBP", quality=quality)
+    tiny = thumb.resize((placeholder_width, max(1, round(thumb.height * placeholder_width / thumb_width))), Image.BILINEAR)
+    tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+    small = io.BytesIO()
+    tiny.save(small, format="WEBP", quality=30)
+    placeholder = "data:image/webp;base64," + base64.b64encode(small.getvalue()).decode("ascii")
+    return out.getvalue(), {"w": thumb.width, "h": thumb.height, "placeholder": placeholder}
+
+def previews_enabled():
+    return _preview_pool is not None
+
+def preview(data):
+    """ (miniature, meta) d'une image (bytes ou PageBody), calculés sur le pool d'aperçus """
+    if not isinstance(data, bytes): data = data.read()
+    return _preview_pool.submit(make_preview, data, **previews).result()
+
+def image_meta(data):
+    """ Dimensions d'une image ({"w", "h"}), lues dans l'en-tête seulement. {} si illisible """
+    try:
+        source = io.BytesIO(data) if isinstance(data, bytes) else data.open() # bytes ou PageBody
+        with source, Image.open(source) as img:
+            return {"w": img.width, "h": img.height}
+    except Exception:
+        return {}
+
+def convert(filename, data):
+    """
+    Retourne la liste des fichiers à uploader pour une page : [(nom, bytes), ...]
+    (la version transcodée, plus l'original si keep_original).
+    """
+    if _pool is None:
+        return [(filename, data)] # Pas de transcodage : la page part telle quelle (en flux)
+    stem = filename.rsplit('.', 1)[0]
+    if not isinstance(data, bytes): data = data.read() # L'encodeur a besoin de l'image entière
+    encoded = _pool.submit(encode, data, options["format"], options["quality"], options["max_width"]).result()
+    files = [(f"{stem}.{options['format']}", encoded)]
+    if options["keep_original"]:
+        files.append((filename, data))
+    return files